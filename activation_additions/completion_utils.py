@@ -45,6 +45,7 @@ def gen_using_model(
     tokens_to_generate: int = 40,
     seed: Optional[int] = None,
     include_logits: bool = False,
+    input_tokens: Optional[Int[t.Tensor, "batch pos"]] = None,
     log: Union[bool, Dict] = False,  # pylint: disable=unused-argument
     **sampling_kwargs,
 ) -> pd.DataFrame:
@@ -63,6 +64,11 @@ def gen_using_model(
         `include_logits`: True to include the full logits tensors as a
         column in the returned DataFrame.
 
+        `input_tokens`: Optional pre-tokenized `prompt_batch`, with one
+        row per prompt.  If provided, the prompts are not tokenized
+        again, and `prompt_batch` is only used for the `prompts`
+        column.
+
         `log`: To enable logging of this call to wandb, pass either
         True, or a dict contining any of ('tags', 'group', 'notes') to
         pass these keys to the wandb init call.  False to disable
@@ -83,8 +89,8 @@ def gen_using_model(
     if seed is not None:
         t.manual_seed(seed)
 
-    tokenized_prompts: Int[t.Tensor, "batch pos"] = model.to_tokens(
-        prompt_batch
+    tokenized_prompts: Int[t.Tensor, "batch pos"] = (
+        model.to_tokens(prompt_batch) if input_tokens is None else input_tokens
     )
     completions: Float[t.Tensor, "batch pos"] = model.generate(
         input=tokenized_prompts,
@@ -140,6 +146,7 @@ def gen_using_hooks(
     tokens_to_generate: int = 40,
     seed: Optional[int] = None,
     include_logits: bool = False,
+    input_tokens: Optional[Int[t.Tensor, "batch pos"]] = None,
     log: Union[bool, Dict] = False,  # pylint: disable=unused-argument
     **sampling_kwargs,
 ) -> pd.DataFrame:
@@ -160,6 +167,11 @@ def gen_using_hooks(
         `include_logits`: True to include the full logits tensors as a
         column in the returned DataFrame.
 
+        `input_tokens`: Optional pre-tokenized `prompt_batch`, with one
+        row per prompt.  If provided, the prompts are not tokenized
+        again, and `prompt_batch` is only used for the `prompts`
+        column.
+
         `log`: To enable logging of this call to wandb, pass either
         True, or a dict contining any of ('tags', 'group', 'notes') to
         pass these keys to the wandb init call.  False to disable logging.
@@ -191,7 +203,8 @@ def gen_using_hooks(
             tokens_to_generate,
             seed,
             include_logits,
-            log,
+            input_tokens=input_tokens,
+            log=log,
             **sampling_kwargs,
         )
 
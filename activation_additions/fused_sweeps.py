@@ -0,0 +1,160 @@
+""" Functions for sweeping many ActivationAddition lists over prompts with
+one batched generate call per group of lists, rather than one call per
+list. """
+
+from typing import Iterable, Optional, List, Union, Dict, Callable
+
+import pandas as pd
+from tqdm.auto import tqdm
+from transformer_lens import HookedTransformer
+
+from activation_additions import logging, hook_utils
+from activation_additions.prompt_utils import ActivationAddition
+from activation_additions.completion_utils import gen_using_hooks
+from activation_additions.sweeps import _PreallocatedFrame
+
+
+def _hook_fns_for_rows(
+    model: HookedTransformer,
+    activation_additions: List[List[ActivationAddition]],
+    activation_cache: Dict,
+    rows_per_addition: int,
+) -> Dict[str, List[Callable]]:
+    """Combine the hook functions of each of the `activation_additions`
+    lists, restricting the i-th list to the i-th block of
+    `rows_per_addition` rows of the batch."""
+    hook_fns: Dict[str, List[Callable]] = {}
+    for row, activation_additions_this in enumerate(activation_additions):
+        row_hook_fns = hook_utils.hook_fns_from_activation_additions(
+            model=model,
+            activation_additions=activation_additions_this,
+            activation_cache=activation_cache,
+            batch_slice=slice(
+                row * rows_per_addition, (row + 1) * rows_per_addition
+            ),
+        )
+        for act_name, hook_fns_this in row_hook_fns.items():
+            hook_fns.setdefault(act_name, []).extend(hook_fns_this)
+    return hook_fns
+
+
+@logging.loggable
+def sweep_over_layers_fused(
+    model: HookedTransformer,
+    prompts: Iterable[str],
+    activation_additions: Iterable[List[ActivationAddition]],
+    num_patched_completions: int = 100,
+    tokens_to_generate: int = 40,
+    seed: Optional[int] = None,
+    max_batch_size: Optional[int] = 512,
+    log: Union[bool, Dict] = False,  # pylint: disable=unused-argument
+    **sampling_kwargs,
+) -> pd.DataFrame:
+    """Apply each provided ActivationAddition list to each prompt, as
+    `sweep_over_prompts` does for its patched completions, but generate
+    the completions for many lists in each batched `generate` call
+    rather than one call per list.  Each ActivationAddition list is
+    assigned its own rows of the batch, and its hook functions only
+    modify those rows, so the hooks for every layer and coeff (e.g. from
+    `make_activation_additions`) can be installed at once without
+    interfering with each other.
+
+    args:
+        model: The model to use for completion.
+
+        prompts: The prompts to use for completion.
+
+        activation_additions: An iterable of ActivationAddition lists to
+        patch into the prompts, in all permutations.
+
+        num_patched_completions: Number of completions to generate for
+        each prompt/ActivationAddition combination.
+
+        tokens_to_generate: The number of additional tokens to generate.
+
+        seed: A random seed to use for generation.
+
+        max_batch_size: The maximum number of completions to generate
+        in a single call to the model.  Each call always covers at
+        least one ActivationAddition list.  None puts all the lists for
+        a prompt in a single call, whose batch grows with the number of
+        lists and can easily exhaust memory for large sweeps.
+
+        `log`: To enable logging of this call to wandb, pass either
+        True, or a dict contining any of ('tags', 'group', 'notes') to
+        pass these keys to the wandb init call.  False to disable logging.
+
+        sampling_kwargs: Keyword arguments to pass to the model's
+        generate function.
+
+    returns:
+        A DataFrame containing the patched completions in the same form
+        as returned by `sweep_over_prompts`.
+    """
+    prompts = list(prompts)
+    activation_additions = list(activation_additions)
+    activation_cache = hook_utils.precompute_activation_cache(
+        model, activation_additions
+    )
+    if max_batch_size is None:
+        additions_per_batch = max(1, len(activation_additions))
+    else:
+        additions_per_batch = max(
+            1, max_batch_size // max(1, num_patched_completions)
+        )
+    patched_frame = _PreallocatedFrame(
+        total_rows=len(prompts)
+        * len(activation_additions)
+        * num_patched_completions,
+        index_name="completion_index",
+    )
+    # Track progress with a single flat counter over all
+    # (prompt, ActivationAddition list) pairs
+    pbar = tqdm(total=len(prompts) * len(activation_additions))
+    for prompt_index, prompt in enumerate(prompts):
+        # Build the input tokens for a full batch once per prompt; the
+        # last batch may use only the first rows
+        batch_tokens = model.to_tokens(prompt).repeat(
+            additions_per_batch * num_patched_completions, 1
+        )
+        for start in range(0, len(activation_additions), additions_per_batch):
+            indices = range(
+                start,
+                min(start + additions_per_batch, len(activation_additions)),
+            )
+            # Generate the completions for all these ActivationAddition
+            # lists at once, with logging forced off since we'll be
+            # logging to final DataFrames
+            batch_size = len(indices) * num_patched_completions
+            batch_df: pd.DataFrame = gen_using_hooks(
+                model=model,
+                prompt_batch=[prompt] * batch_size,
+                hook_fns=_hook_fns_for_rows(
+                    model=model,
+                    activation_additions=[
+                        activation_additions[index] for index in indices
+                    ],
+                    activation_cache=activation_cache,
+                    rows_per_addition=num_patched_completions,
+                ),
+                tokens_to_generate=tokens_to_generate,
+                seed=seed,
+                input_tokens=batch_tokens[:batch_size],
+                log=False,
+                **sampling_kwargs,
+            )
+            # Split the batch back up by ActivationAddition list
+            for row, index in enumerate(indices):
+                first_row = row * num_patched_completions
+                patched_df = batch_df.iloc[
+                    first_row : first_row + num_patched_completions
+                ].reset_index(drop=True)
+                patched_df["activation_addition_index"] = index
+                patched_frame.set_rows(
+                    (prompt_index * len(activation_additions) + index)
+                    * num_patched_completions,
+                    patched_df,
+                )
+            pbar.update(len(indices))
+    pbar.close()
+    return patched_frame.to_frame()
@@ -1,6 +1,15 @@
 """ Utilities for hooking into a model and modifying activations. """
 
-from typing import List, Callable, Optional, Dict, Tuple, Union, Any
+from typing import (
+    List,
+    Callable,
+    Optional,
+    Dict,
+    Tuple,
+    Union,
+    Any,
+    Iterable,
+)
 from collections import defaultdict
 from jaxtyping import Float, Int
 import torch
@@ -33,18 +42,45 @@ def apply_activation_additions(
     return model.hooks(fwd_hooks=hook_fns)
 
 
-def get_prompt_activations(  # TODO rename
-    model: HookedTransformer, activation_addition: ActivationAddition
+# Maps an (input, act_name) pair to the unscaled activations at
+# act_name for that input, where input is a prompt string or a tuple of
+# token ids
+ActivationCacheDict = Dict[
+    Tuple[Union[str, Tuple[int, ...]], str],
+    Float[torch.Tensor, "batch pos d_model"],
+]
+
+
+def _activation_cache_key(
+    activation_addition: ActivationAddition,
+) -> Tuple[Union[str, Tuple[int, ...]], str]:
+    """Return the key identifying the unscaled activations of an
+    `ActivationAddition` in an `ActivationCacheDict`."""
+    if hasattr(activation_addition, "tokens"):
+        return (
+            tuple(activation_addition.tokens.tolist()),
+            activation_addition.act_name,
+        )
+    return (activation_addition.prompt, activation_addition.act_name)
+
+
+def _get_unscaled_activations(
+    model: HookedTransformer,
+    activation_addition: ActivationAddition,
+    activation_cache: Optional[ActivationCacheDict] = None,
 ) -> Float[torch.Tensor, "batch pos d_model"]:
-    """Takes a `ActivationAddition` and returns the rescaled activations for that
-    prompt, for the appropriate `act_name`. Rescaling is done by running
-    the model forward with the prompt and then multiplying the
-    activations by the coefficient `activation_addition.coeff`.
-    """
+    """Return the activations at `activation_addition.act_name` for the
+    prompt or tokens of `activation_addition`, ignoring its `coeff`,
+    using and filling `activation_cache` if provided."""
+    key = _activation_cache_key(activation_addition)
+    if activation_cache is not None and key in activation_cache:
+        return activation_cache[key]
+
     # Get tokens for prompt
     tokens: Int[torch.Tensor, "seq"]
     if hasattr(activation_addition, "tokens"):
-        tokens = activation_addition.tokens
+        # Tokens may be stored on the CPU, so move them to the model
+        tokens = activation_addition.tokens.to(model.cfg.device)
     else:
         tokens = model.to_tokens(activation_addition.prompt)
 
@@ -54,13 +90,163 @@ def get_prompt_activations(  # TODO rename
         tokens,
         names_filter=lambda act_name: act_name == activation_addition.act_name,
     )[1]
+    activations = cache[activation_addition.act_name]
+    if activation_cache is not None:
+        activation_cache[key] = activations
+    return activations
+
+
+def get_prompt_activations(  # TODO rename
+    model: HookedTransformer,
+    activation_addition: ActivationAddition,
+    activation_cache: Optional[ActivationCacheDict] = None,
+) -> Float[torch.Tensor, "batch pos d_model"]:
+    """Takes a `ActivationAddition` and returns the rescaled activations for that
+    prompt, for the appropriate `act_name`. Rescaling is done by running
+    the model forward with the prompt and then multiplying the
+    activations by the coefficient `activation_addition.coeff`.
 
+    If `activation_cache` is provided, the unscaled activations are
+    looked up there, and stored there if missing, so that
+    `ActivationAddition`s differing only in `coeff` share one forward
+    pass.
+    """
     # Return cached activations times coefficient
-    return activation_addition.coeff * cache[activation_addition.act_name]
+    return activation_addition.coeff * _get_unscaled_activations(
+        model, activation_addition, activation_cache=activation_cache
+    )
+
+
+def precompute_activation_cache(
+    model: HookedTransformer,
+    activation_additions: Iterable[List[ActivationAddition]],
+    pad_to_multiple_of: int = 8,
+) -> ActivationCacheDict:
+    """Run a forward pass for each activation name over all the unique
+    inputs in an iterable of `ActivationAddition` lists, such as those
+    produced by `sweeps.make_activation_additions`, and return the
+    unscaled activations for use as the `activation_cache` argument of
+    `get_prompt_activations` and the functions built on it.
+
+    The inputs for each activation name are right-padded into a single
+    batch whose length is a multiple of `pad_to_multiple_of`, which
+    lets the forward pass use tensor-core friendly shapes.  Since
+    attention is causal, the padding can't affect the activations at
+    earlier positions, and it is sliced off again before caching.
+    Models without causal attention fall back to one forward pass per
+    input."""
+    # Collect one ActivationAddition for each unique input, grouped by
+    # act_name
+    unique_by_act_name: Dict[
+        str,
+        Dict[Tuple[Union[str, Tuple[int, ...]], str], ActivationAddition],
+    ] = defaultdict(dict)
+    for activation_additions_this in activation_additions:
+        for activation_addition in activation_additions_this:
+            key = _activation_cache_key(activation_addition)
+            unique_by_act_name[activation_addition.act_name].setdefault(
+                key, activation_addition
+            )
+
+    activation_cache: ActivationCacheDict = {}
+    for act_name, unique_this in unique_by_act_name.items():
+        if model.cfg.attention_dir != "causal":
+            for activation_addition in unique_this.values():
+                _get_unscaled_activations(
+                    model, activation_addition, activation_cache
+                )
+            continue
+        tokens_list: List[Int[torch.Tensor, "seq"]] = [
+            activation_addition.tokens
+            if hasattr(activation_addition, "tokens")
+            else model.to_tokens(activation_addition.prompt)[0]
+            for activation_addition in unique_this.values()
+        ]
+        # Pad all inputs into one batch.  The padding token id doesn't
+        # matter, since the padded positions are discarded.
+        max_len = max(tokens.shape[-1] for tokens in tokens_list)
+        padded_len = -(-max_len // pad_to_multiple_of) * pad_to_multiple_of
+        batch = torch.zeros(
+            (len(tokens_list), padded_len),
+            dtype=torch.long,
+            device=model.cfg.device,
+        )
+        for row, tokens in enumerate(tokens_list):
+            batch[row, : tokens.shape[-1]] = tokens
+        activations = model.run_with_cache(
+            batch,
+            names_filter=lambda name, act_name=act_name: name == act_name,
+        )[1][act_name]
+        # Store each input's activations with the padding removed
+        for row, (key, tokens) in enumerate(zip(unique_this, tokens_list)):
+            activation_cache[key] = activations[
+                row : row + 1, : tokens.shape[-1]
+            ]
+    return activation_cache
+
+
+def precompute_prompt_activations(
+    model: HookedTransformer,
+    prompts: Iterable[str],
+    act_names: Iterable[str],
+) -> ActivationCacheDict:
+    """Run a single forward pass for each unique prompt, caching its
+    activations at all of `act_names` at once, and return them as an
+    `ActivationCacheDict`.  This is cheaper than
+    `precompute_activation_cache` when the same few prompts are needed
+    at many activation names, e.g. when sweeping over layers."""
+    act_names_set = set(act_names)
+    activation_cache: ActivationCacheDict = {}
+    for prompt in dict.fromkeys(prompts):
+        cache: ActivationCache = model.run_with_cache(
+            model.to_tokens(prompt),
+            names_filter=lambda name: name in act_names_set,
+        )[1]
+        for act_name in act_names_set:
+            activation_cache[(prompt, act_name)] = cache[act_name]
+    return activation_cache
+
+
+def batched_prompt_activations(
+    model: HookedTransformer,
+    activation_additions: List[ActivationAddition],
+) -> Float[torch.Tensor, "batch pos d_model"]:
+    """Return the sum of the rescaled activations of
+    `activation_additions`, as adding up their `get_prompt_activations`
+    would, but running all of their inputs through the model in a single
+    padded batch.  Activations shorter than the longest are zero-padded
+    at the end, as in `steering_vec_magnitudes`."""
+    assert (
+        len({act_add.act_name for act_add in activation_additions}) == 1
+    ), "All ActivationAdditions must have the same act_name."
+    activation_cache: ActivationCacheDict = precompute_activation_cache(
+        model, [activation_additions]
+    )
+    activations_lst: List[Float[torch.Tensor, "batch pos d_model"]] = [
+        get_prompt_activations(
+            model, activation_addition, activation_cache=activation_cache
+        )
+        for activation_addition in activation_additions
+    ]
+
+    # Sum the activations into a buffer long enough for all of them
+    max_seq_len: int = max(act.shape[1] for act in activations_lst)
+    summed_activations: Float[torch.Tensor, "batch pos d_model"] = (
+        torch.zeros(
+            (1, max_seq_len, activations_lst[0].shape[-1]),
+            dtype=activations_lst[0].dtype,
+            device=activations_lst[0].device,
+        )
+    )
+    for act in activations_lst:
+        summed_activations[:, : act.shape[1]] += act
+    return summed_activations
 
 
 def get_activation_dict(
-    model: HookedTransformer, activation_additions: List[ActivationAddition]
+    model: HookedTransformer,
+    activation_additions: List[ActivationAddition],
+    activation_cache: Optional[ActivationCacheDict] = None,
 ) -> Dict[str, List[Float[torch.Tensor, "batch pos d_model"]]]:
     """Takes a list of `ActivationAddition`s and returns a dictionary mapping
     activation names to lists of activations.
@@ -73,7 +259,56 @@ def get_activation_dict(
     # Add activations for each prompt
     for activation_addition in activation_additions:
         activation_dict[activation_addition.act_name].append(
-            get_prompt_activations(model, activation_addition)
+            get_prompt_activations(
+                model, activation_addition, activation_cache=activation_cache
+            )
+        )
+
+    return activation_dict
+
+
+def get_fused_activation_dict(
+    model: HookedTransformer,
+    activation_additions: List[ActivationAddition],
+    activation_cache: Optional[ActivationCacheDict] = None,
+) -> Dict[str, List[Float[torch.Tensor, "batch pos d_model"]]]:
+    """Like `get_activation_dict`, but `ActivationAddition`s that share
+    an activation name and sequence length (e.g. padded phrases from
+    `sweeps.make_activation_additions`) are combined into a single
+    tensor, computed as a coefficient-weighted sum of their stacked
+    unscaled activations.  Adding the returned activations is
+    equivalent to adding each `ActivationAddition` separately, but
+    needs only one hook function per group.
+    """
+    # Gather the coeffs and unscaled activations of each group, in
+    # order of first appearance
+    groups: Dict[
+        Tuple[str, int],
+        Tuple[List[float], List[Float[torch.Tensor, "batch pos d_model"]]],
+    ] = {}
+    for activation_addition in activation_additions:
+        activations = _get_unscaled_activations(
+            model, activation_addition, activation_cache=activation_cache
+        )
+        coeffs, activations_list = groups.setdefault(
+            (activation_addition.act_name, activations.shape[1]), ([], [])
+        )
+        coeffs.append(activation_addition.coeff)
+        activations_list.append(activations)
+
+    # Combine each group with a single weighted sum
+    activation_dict: Dict[
+        str, List[Float[torch.Tensor, "batch pos d_model"]]
+    ] = defaultdict(list)
+    for (act_name, _), (coeffs, activations_list) in groups.items():
+        stacked: Float[torch.Tensor, "n batch pos d_model"] = torch.stack(
+            activations_list
+        )
+        coeffs_tensor: Float[torch.Tensor, "n"] = torch.tensor(
+            coeffs, dtype=stacked.dtype, device=stacked.device
+        )
+        activation_dict[act_name].append(
+            torch.einsum("n,n...->...", coeffs_tensor, stacked)
         )
 
     return activation_dict
@@ -81,13 +316,20 @@ def get_activation_dict(
 
 # Get magnitudes
 def steering_vec_magnitudes(
-    act_adds: List[ActivationAddition], model: HookedTransformer
+    act_adds: List[ActivationAddition],
+    model: HookedTransformer,
+    activation_cache: Optional[ActivationCacheDict] = None,
 ) -> Float[torch.Tensor, "pos"]:
     """Compute the magnitude of the net steering vector at each sequence
-    position."""
+    position.  Activations are looked up in `activation_cache` if
+    provided."""
     act_dict: Dict[
         str, List[Float[torch.Tensor, "batch pos d_model"]]
-    ] = get_activation_dict(model=model, activation_additions=act_adds)
+    ] = get_activation_dict(
+        model=model,
+        activation_additions=act_adds,
+        activation_cache=activation_cache,
+    )
     if len(act_dict) > 1:
         raise NotImplementedError(
             "Only one activation name is supported for now."
@@ -126,22 +368,38 @@ def steering_vec_magnitudes(
     )
 
     # Compute the norm of the summed activations
-    return torch.linalg.norm(summed_activations, dim=-1)
+    return _residual_norms(summed_activations)
+
+
+def _residual_norms(
+    activations: Float[torch.Tensor, "... d_model"],
+) -> Float[torch.Tensor, "..."]:
+    """Compute the L2 norms of `activations` over the residual stream
+    dimension."""
+    return torch.linalg.vector_norm(activations, ord=2, dim=-1)
 
 
 def prompt_magnitudes(
-    prompt: str, model: HookedTransformer, act_name: str
+    prompt: str,
+    model: HookedTransformer,
+    act_name: str,
+    activation_cache: Optional[ActivationCacheDict] = None,
 ) -> Float[torch.Tensor, "pos"]:
     """Compute the magnitude of the prompt activations at position
-    `act_name` in `model`'s forward pass on `prompt`."""
-    cache: ActivationCache = model.run_with_cache(
-        model.to_tokens(prompt),
-        # TODO: the below filter does nothing because act_name is
-        # used twice; if we want/need this filtering, the argument to
-        # the lambda should be renamed to avoid this name collision.
-        # names_filter=lambda act_name: act_name == act_name,
-    )[1]
-    prompt_acts: Float[torch.Tensor, "batch pos d_model"] = cache[act_name]
+    `act_name` in `model`'s forward pass on `prompt`.  If the
+    activations are in `activation_cache`, no forward pass is run."""
+    prompt_acts: Float[torch.Tensor, "batch pos d_model"]
+    if activation_cache is not None and (prompt, act_name) in activation_cache:
+        prompt_acts = activation_cache[(prompt, act_name)]
+    else:
+        cache: ActivationCache = model.run_with_cache(
+            model.to_tokens(prompt),
+            # TODO: the below filter does nothing because act_name is
+            # used twice; if we want/need this filtering, the argument to
+            # the lambda should be renamed to avoid this name collision.
+            # names_filter=lambda act_name: act_name == act_name,
+        )[1]
+        prompt_acts = cache[act_name]
     assert (
         prompt_acts.shape[0] == 1
     ), "Prompt activations should have batch dim of 1."
@@ -149,16 +407,56 @@ def prompt_magnitudes(
         len(prompt_acts.shape) == 3
     ), "Prompt activations should have shape (1, seq_len, d_model)."
 
-    return torch.linalg.norm(prompt_acts[0], dim=-1)
+    return _residual_norms(prompt_acts[0])
+
+
+def batched_prompt_magnitudes(
+    prompts: List[str],
+    model: HookedTransformer,
+    act_name: str,
+    prompt_tokens: Optional[List[Int[torch.Tensor, "seq"]]] = None,
+) -> List[Float[torch.Tensor, "pos"]]:
+    """Compute the magnitudes of the activations at `act_name` for each
+    of `prompts`, as `prompt_magnitudes` would, but using a single
+    forward pass over all the prompts.  The prompts are right-padded
+    into one batch; since attention is causal, the padding doesn't
+    affect the activations of the real tokens, and it is dropped from
+    the returned magnitudes.  If `prompt_tokens` is provided, it is
+    used instead of tokenizing `prompts` again, which saves
+    re-tokenizing when sweeping over many act_names."""
+    tokens_list: List[Int[torch.Tensor, "seq"]] = (
+        prompt_tokens
+        if prompt_tokens is not None
+        else [model.to_tokens(prompt)[0] for prompt in prompts]
+    )
+    # The padding token id doesn't matter, since the padded positions
+    # are discarded
+    batch: Int[torch.Tensor, "batch pos"] = torch.zeros(
+        (len(tokens_list), max(tokens.shape[0] for tokens in tokens_list)),
+        dtype=torch.long,
+        device=model.cfg.device,
+    )
+    for row, tokens in enumerate(tokens_list):
+        batch[row, : tokens.shape[0]] = tokens
+
+    cache: ActivationCache = model.run_with_cache(
+        batch, names_filter=lambda name: name == act_name
+    )[1]
+    mags: Float[torch.Tensor, "batch pos"] = _residual_norms(cache[act_name])
+    return [
+        mags[row, : tokens.shape[0]] for row, tokens in enumerate(tokens_list)
+    ]
 
 
 def steering_magnitudes_relative_to_prompt(
     prompt: str,
     act_adds: List[ActivationAddition],
     model: HookedTransformer,
+    activation_cache: Optional[ActivationCacheDict] = None,
 ) -> Float[torch.Tensor, "pos"]:
     """Get the prompt and steering vector magnitudes and return their
-    pairwise division."""
+    pairwise division.  Activations are looked up in
+    `activation_cache` if provided."""
     # Figure out what act_name should be
     if isinstance(act_adds[0].act_name, int):
         act_name: str = get_block_name(block_num=act_adds[0].act_name)
@@ -167,10 +465,13 @@ def steering_magnitudes_relative_to_prompt(
 
     # Get magnitudes
     prompt_mags: Float[torch.Tensor, "pos"] = prompt_magnitudes(
-        prompt=prompt, model=model, act_name=act_name
+        prompt=prompt,
+        model=model,
+        act_name=act_name,
+        activation_cache=activation_cache,
     )
     steering_vec_mags: Float[torch.Tensor, "pos"] = steering_vec_magnitudes(
-        act_adds=act_adds, model=model
+        act_adds=act_adds, model=model, activation_cache=activation_cache
     )
 
     # Divide the steering vector magnitudes by the prompt magnitudes
@@ -183,6 +484,7 @@ def hook_fn_from_activations(
     activations: Float[torch.Tensor, "batch pos d_model"],
     addition_location: str = "front",
     res_stream_slice: slice = slice(None),
+    batch_slice: slice = slice(None),
 ) -> Callable:
     """Takes an activation tensor and returns a hook function that adds the
     cached activations for that prompt to the existing activations at
@@ -198,6 +500,11 @@ def hook_fn_from_activations(
         `res_stream_slice`: The slice of the residual stream dimensions to apply
         the activations to. If `res_stream_slice` is `slice(None)`,
         then the activations are applied to all dimensions.
+
+        `batch_slice`: The slice of the batch to apply the activations
+        to, so that different rows of one batch can receive different
+        activations. By default, the activations are applied to all
+        batch rows.
     """
     if addition_location not in ["front", "mid", "back"]:
         raise ValueError(
@@ -256,7 +563,7 @@ def hook_fn_from_activations(
                 sequence_slice = slice(-activations_seq_len, None)
 
         indexing_operation: Tuple[slice, slice, slice] = (
-            slice(None),  # Apply to all batches
+            batch_slice,  # Apply to all batches by default
             sequence_slice,  # Only add to first/middle/last residual streams
             res_stream_slice,
         )
@@ -302,6 +609,8 @@ def hook_fns_from_act_dict(
 def hook_fns_from_activation_additions(
     model: HookedTransformer,
     activation_additions: List[ActivationAddition],
+    activation_cache: Optional[ActivationCacheDict] = None,
+    fuse: bool = False,
     **kwargs,
 ) -> Dict[str, List[Callable]]:
     """Takes a list of `ActivationAddition`s and makes a single activation-modifying forward hook.
@@ -311,6 +620,13 @@ def hook_fns_from_activation_additions(
 
         `activation_additions`: List of `ActivationAddition` objects
 
+        `activation_cache`: Optional cache of unscaled activations, as
+        returned by `precompute_activation_cache`
+
+        `fuse`: If True, `ActivationAddition`s with the same activation
+        name and sequence length are combined into one hook function
+        using `get_fused_activation_dict`
+
         `kwargs`: kwargs for `hook_fn_from_activations`
 
     returns:
@@ -321,7 +637,9 @@ def hook_fns_from_activation_additions(
     # Get the activation dictionary
     activation_dict: Dict[
         str, List[Float[torch.Tensor, "batch pos d_model"]]
-    ] = get_activation_dict(model, activation_additions)
+    ] = (get_fused_activation_dict if fuse else get_activation_dict)(
+        model, activation_additions, activation_cache=activation_cache
+    )
 
     # Make the hook functions
     hook_fns: Dict[str, List[Callable]] = hook_fns_from_act_dict(
@@ -1,7 +1,19 @@
 """ Functions for performing automated sweeps of algebraic value editing
 over layers, coeffs, etc. """
 
-from typing import Iterable, Optional, List, Tuple, Union, Dict, Any
+import itertools
+import os
+from dataclasses import dataclass
+from typing import (
+    Iterable,
+    Optional,
+    List,
+    Tuple,
+    Union,
+    Dict,
+    Any,
+    Callable,
+)
 
 import numpy as np
 import pandas as pd
@@ -14,10 +26,7 @@ from transformer_lens import HookedTransformer
 
 from activation_additions import metrics, logging, hook_utils
 from activation_additions.prompt_utils import ActivationAddition
-from activation_additions.completion_utils import (
-    gen_using_hooks,
-    gen_using_activation_additions,
-)
+from activation_additions.completion_utils import gen_using_hooks
 
 
 @logging.loggable
@@ -45,61 +54,445 @@ def make_activation_additions(
     assert (
         pad is False or model is not None
     ), "model must be provided if pad==True"
-    rows = []
+    pad_token: Optional[int] = None
+    if pad:
+        pad_token = model.to_single_token(" ")  # type: ignore
+    # Pad each phrase list's tokens once, since the padded tokens don't
+    # depend on act_name or coeff
+    padded_tokens_list: List[Optional[torch.Tensor]] = []
     for phrases_this in phrases:
-        for act_name in act_names:
-            for coeff in coeffs:
-                activation_additions_this = []
-                if pad:
-                    pad_token: int = model.to_single_token(" ")  # type: ignore
-                    # Convert all phrases into tokens
-                    tokens_list = [
-                        model.to_tokens(phrase)[0]  # type: ignore
-                        for phrase, init_coeff in phrases_this
-                    ]
-                    # Get max length of tokens
-                    max_len = max(tokens.shape[-1] for tokens in tokens_list)
-                    # Pad each phrase's tokens
-                    tokens_list = [
-                        torch.nn.functional.pad(
-                            tokens,
-                            (0, max_len - tokens.shape[-1]),
-                            mode="constant",
-                            value=pad_token,
-                        )
-                        for tokens in tokens_list
-                    ]
-                    # Create the ActivationAdditions using the padded tokens
-                    for (phrase, init_coeff), tokens in zip(
-                        phrases_this, tokens_list
-                    ):
-                        activation_additions_this.append(
-                            ActivationAddition(
-                                coeff=init_coeff * coeff,
-                                act_name=act_name,
-                                tokens=tokens.squeeze(),
-                            )
-                        )
-                else:
-                    # Create the ActivationAdditions using the phrase strings
-                    for phrase, init_coeff in phrases_this:
-                        activation_additions_this.append(
-                            ActivationAddition(
-                                coeff=init_coeff * coeff,
-                                act_name=act_name,
-                                prompt=phrase,
-                            )
-                        )
-                rows.append(
+        if not pad:
+            padded_tokens_list.append(None)
+            continue
+        # Convert all phrases into tokens.  Tokens are kept on the CPU
+        # until they're needed for a forward pass.
+        tokens_list = [
+            model.to_tokens(phrase)[0].cpu()  # type: ignore
+            for phrase, init_coeff in phrases_this
+        ]
+        # Pad all phrases' tokens into a single tensor, one row per
+        # phrase
+        max_len = max(tokens.shape[-1] for tokens in tokens_list)
+        padded_tokens = torch.full(
+            (len(tokens_list), max_len),
+            pad_token,
+            dtype=tokens_list[0].dtype,
+        )
+        for row, tokens in enumerate(tokens_list):
+            padded_tokens[row, : tokens.shape[-1]] = tokens
+        padded_tokens_list.append(padded_tokens)
+
+    # Build the input columns directly as arrays, in the same
+    # phrases-major, coeff-minor order as nested loops would produce
+    act_name_col = np.tile(
+        np.repeat(np.asarray(act_names), len(coeffs)), len(phrases)
+    )
+    coeff_col = np.tile(np.asarray(coeffs), len(phrases) * len(act_names))
+    phrase_indices = np.repeat(
+        np.arange(len(phrases)), len(act_names) * len(coeffs)
+    )
+    phrases_col = [phrases[phrase_index] for phrase_index in phrase_indices]
+
+    # Create the ActivationAdditions, using the padded tokens if
+    # available, otherwise the phrase strings
+    activation_additions_col = []
+    for phrase_index, act_name, coeff in itertools.product(
+        range(len(phrases)), act_names, coeffs
+    ):
+        padded_tokens = padded_tokens_list[phrase_index]
+        activation_additions_col.append(
+            [
+                ActivationAddition(
+                    coeff=init_coeff * coeff,
+                    act_name=act_name,
+                    prompt=phrase if padded_tokens is None else None,
+                    # Each ActivationAddition gets its own copy of its
+                    # row, so that modifying one's tokens in place can't
+                    # change any other's
+                    tokens=(
+                        None
+                        if padded_tokens is None
+                        else padded_tokens[row].clone()
+                    ),
+                )
+                for row, (phrase, init_coeff) in enumerate(
+                    phrases[phrase_index]
+                )
+            ]
+        )
+
+    return pd.DataFrame(
+        {
+            "activation_additions": activation_additions_col,
+            "phrases": phrases_col,
+            "act_name": act_name_col,
+            "coeff": coeff_col,
+        },
+        copy=False,
+    )
+
+
+def _group_prompts_by_length(
+    prompt_tokens: List[torch.Tensor],
+) -> List[List[int]]:
+    """Group the indices of the provided tokenized prompts by length.
+    Prompts in the same group can be stacked into a single batch without
+    padding, which would otherwise corrupt generation since
+    `model.generate` always continues from the final position."""
+    groups: Dict[int, List[int]] = {}
+    for prompt_index, tokens in enumerate(prompt_tokens):
+        prompt_len = tokens.shape[-1]
+        groups.setdefault(prompt_len, []).append(prompt_index)
+    return [groups[prompt_len] for prompt_len in sorted(groups)]
+
+
+def _make_prompt_batches(
+    prompt_tokens: List[torch.Tensor],
+    prompt_groups: List[List[int]],
+    num_completions: int,
+    max_batch_size: Optional[int] = None,
+) -> List[Tuple[List[int], torch.Tensor]]:
+    """Split each group of equal-length prompts into batches, returning
+    the prompt indices of each batch along with its input tokens, in
+    which each prompt's row of `prompt_tokens` is repeated
+    `num_completions` times.  If `max_batch_size` is provided, each
+    batch holds at most that many completions (but always at least one
+    prompt).  The token tensors are built once here so that they can be
+    reused by every generate call over the same batches, rather than
+    being re-allocated for each one."""
+    if max_batch_size is None:
+        prompts_per_batch = max(1, len(prompt_tokens))
+    else:
+        prompts_per_batch = max(1, max_batch_size // max(1, num_completions))
+    batch_indices = [
+        group[start : start + prompts_per_batch]
+        for group in prompt_groups
+        for start in range(0, len(group), prompts_per_batch)
+    ]
+    return [
+        (
+            indices,
+            torch.cat(
+                [
+                    prompt_tokens[prompt_index].expand(num_completions, -1)
+                    for prompt_index in indices
+                ]
+            ),
+        )
+        for indices in batch_indices
+    ]
+
+
+def _gen_over_prompt_batches(
+    model: HookedTransformer,
+    prompts: List[str],
+    prompt_batches: List[Tuple[List[int], torch.Tensor]],
+    num_completions: int,
+    hook_fns: Dict[str, List[Callable]],
+    pbar: Optional[Any] = None,
+    **kwargs,
+) -> List[pd.DataFrame]:
+    """Generate `num_completions` completions for each prompt in
+    `prompt_batches`, as returned by `_make_prompt_batches`, running
+    each batch through `gen_using_hooks`.  Returns one DataFrame per
+    prompt, in the original prompt order, each indexed from zero as if
+    it had been generated on its own; prompts not in any batch get an
+    empty DataFrame.  If a tqdm progress bar `pbar` is provided, it is
+    advanced by the number of prompts in each batch.
+
+    Batches are run one after another rather than concurrently (e.g.
+    on separate CUDA streams): `model.generate` synchronizes with the
+    host at every step, and hooks and the seeded RNG are global model
+    and torch state, so batching is the way to keep the GPU busy."""
+    prompt_dfs: List[pd.DataFrame] = [pd.DataFrame()] * len(prompts)
+    for indices, input_tokens in prompt_batches:
+        batch_df: pd.DataFrame = gen_using_hooks(
+            model=model,
+            prompt_batch=[
+                prompts[prompt_index]
+                for prompt_index in indices
+                for _ in range(num_completions)
+            ],
+            hook_fns=hook_fns,
+            input_tokens=input_tokens,
+            log=False,
+            **kwargs,
+        )
+        for pos, prompt_index in enumerate(indices):
+            prompt_dfs[prompt_index] = batch_df.iloc[
+                pos * num_completions : (pos + 1) * num_completions
+            ].reset_index(drop=True)
+        if pbar is not None:
+            pbar.update(len(indices))
+    return prompt_dfs
+
+
+class _PreallocatedFrame:
+    """Assembles a DataFrame from equal-length chunks by writing each
+    chunk into pre-allocated column arrays, rather than concatenating a
+    large list of small DataFrames at the end.  The index of each chunk
+    is stored as a column named `index_name`, matching the result of
+    `pd.concat(chunks).reset_index(names=index_name)`.  That only holds
+    while every chunk has the same numpy dtypes, since `pd.concat`
+    combines differing dtypes depending on the values (e.g. bool chunks
+    with NaN become object); chunks with extension dtypes or with
+    dtypes that differ from the earlier chunks make the frame fall back
+    to concatenating the chunks."""
+
+    def __init__(self, total_rows: int, index_name: str):
+        self.total_rows = total_rows
+        self.index_name = index_name
+        self.columns: Dict[str, np.ndarray] = {}
+        # Row ranges written so far, and the chunks to concatenate once
+        # the frame has fallen back to pd.concat
+        self.written: List[Tuple[int, int]] = []
+        self.chunks: Optional[List[Tuple[int, pd.DataFrame]]] = None
+
+    def _fall_back_to_concat(self):
+        """Move the rows written so far into `self.chunks`, so that the
+        frame is built with `pd.concat` from now on."""
+        self.chunks = [
+            (
+                start,
+                pd.DataFrame(
                     {
-                        "activation_additions": activation_additions_this,
-                        "phrases": phrases_this,
-                        "act_name": act_name,
-                        "coeff": coeff,
+                        col: values[start:stop]
+                        for col, values in self.columns.items()
                     }
+                ),
+            )
+            for start, stop in self.written
+        ]
+        self.columns = {}
+
+    def set_rows(self, start: int, chunk: pd.DataFrame):
+        """Write the rows of `chunk` into the frame, starting at row
+        `start`."""
+        if self.chunks is None and not all(
+            isinstance(dtype, np.dtype)
+            for dtype in [chunk.index.dtype, *chunk.dtypes]
+        ):
+            self._fall_back_to_concat()
+        if self.chunks is not None:
+            self.chunks.append(
+                (start, chunk.reset_index(names=self.index_name))
+            )
+            return
+        if not self.columns:
+            # Allocate the columns using the dtypes of the first chunk
+            self.columns[self.index_name] = np.empty(
+                self.total_rows, dtype=chunk.index.dtype
+            )
+            for col in chunk.columns:
+                self.columns[col] = np.empty(
+                    self.total_rows, dtype=chunk[col].dtype
                 )
+        if (
+            list(chunk.columns) != list(self.columns)[1:]
+            or chunk.index.dtype != self.columns[self.index_name].dtype
+            or any(
+                chunk[col].dtype != self.columns[col].dtype for col in chunk
+            )
+        ):
+            self._fall_back_to_concat()
+            self.set_rows(start, chunk)
+            return
+        stop = start + len(chunk)
+        self.columns[self.index_name][start:stop] = chunk.index.to_numpy()
+        for col in chunk.columns:
+            self.columns[col][start:stop] = chunk[col].to_numpy()
+        self.written.append((start, stop))
+
+    def to_frame(self) -> pd.DataFrame:
+        """Return the assembled DataFrame."""
+        if self.chunks is not None:
+            self.chunks.sort(key=lambda item: item[0])
+            # pd.concat ignores empty chunks when combining dtypes, but only
+            # if they are empty before their index is reset
+            chunks = [chunk for _, chunk in self.chunks if len(chunk)]
+            return pd.concat(
+                chunks or [chunk for _, chunk in self.chunks],
+                ignore_index=True,
+            )
+        return pd.DataFrame(self.columns, copy=False)
+
+
+class _ParquetStreamWriter:
+    """Appends equal-length DataFrame chunks to a Parquet file as they
+    are produced, so that sweep results never have to be held in memory
+    all at once.  Shares the `set_rows` interface of
+    `_PreallocatedFrame`, but rows are written in call order and
+    `start` is ignored.  Metric columns are added to each chunk before
+    it is written.  Requires the optional `pyarrow` package."""
+
+    def __init__(
+        self,
+        path: str,
+        index_name: str,
+        metrics_dict: Optional[Dict[str, Callable]] = None,
+    ):
+        # pylint: disable=import-outside-toplevel
+        import pyarrow
+        import pyarrow.parquet
+
+        # pylint: enable=import-outside-toplevel
+        self.pyarrow = pyarrow
+        self.parquet = pyarrow.parquet
+        self.path = path
+        self.index_name = index_name
+        self.metrics_dict = metrics_dict
+        self.writer = None
+
+    def set_rows(
+        self,
+        start: int,  # pylint: disable=unused-argument
+        chunk: pd.DataFrame,
+    ):
+        """Append the rows of `chunk` to the file."""
+        chunk = chunk.reset_index(names=self.index_name)
+        if self.metrics_dict is not None:
+            with torch.inference_mode():
+                chunk = metrics.add_metric_cols(chunk, self.metrics_dict)
+        table = self.pyarrow.Table.from_pandas(chunk, preserve_index=False)
+        if self.writer is None:
+            self.writer = self.parquet.ParquetWriter(self.path, table.schema)
+        else:
+            table = table.cast(self.writer.schema)
+        self.writer.write_table(table)
+
+    def close(self) -> str:
+        """Close the file and return its path."""
+        if self.writer is not None:
+            self.writer.close()
+        return self.path
+
+    def abort(self):
+        """Close and delete the file, after an error has left it
+        incomplete.  A file that this writer never opened, e.g. one left
+        by an earlier run at the same path, is left alone."""
+        if self.writer is not None:
+            self.writer.close()
+            os.remove(self.path)
+
+
+@dataclass
+class SweepOptions:
+    """Optional settings for `sweep_over_prompts`.
+
+    attributes:
+        max_batch_size: The maximum number of completions to generate
+        in a single call to the model, or None for no limit.  Prompts
+        are sorted by token length and batched with other prompts of
+        the same length, up to this limit.  Changing it changes sampled
+        (but not greedy) completions, even with the same `seed`.
+
+        normal_cache: An optional dict in which to store the normal
+        completions for each prompt, keyed on the prompt and the
+        generation arguments.  Passing the same dict to repeated calls
+        with the same model skips regenerating normal completions that
+        have already been generated.  The key doesn't include the
+        batch a prompt was generated in, so when sampling, cached
+        completions can differ from those the same call would generate
+        without the cache, even with the same `seed`.
+
+        output_path: If provided, results are streamed to the Parquet
+        files `{output_path}_normal.parquet` and
+        `{output_path}_patched.parquet` as they are generated, instead
+        of being held in memory, and the paths of these files are
+        returned in place of the DataFrames.  Metric columns are added
+        as each chunk is written.  Patched rows are written in
+        generation order, i.e. by ActivationAddition, then by prompt.
+        Requires `pyarrow`.
+
+        fuse_activation_additions: If True, the ActivationAdditions in
+        each list that share an activation name and token length (e.g.
+        those made with `make_activation_additions(pad=True)`) are
+        injected with a single hook function, using their
+        coefficient-weighted sum.
+
+        categorical_prompts: If True, the `prompts` column of the
+        returned DataFrames is a categorical column holding one code
+        per row, rather than one string object per row.  Ignored if
+        `output_path` is provided.
+    """
+
+    max_batch_size: Optional[int] = None
+    normal_cache: Optional[Dict[Tuple, pd.DataFrame]] = None
+    output_path: Optional[str] = None
+    fuse_activation_additions: bool = False
+    categorical_prompts: bool = False
+
+
+_SweepFrame = Union[_PreallocatedFrame, _ParquetStreamWriter]
 
-    return pd.DataFrame(rows)
+
+def _make_sweep_frame(
+    total_rows: int,
+    output_path: Optional[str],
+    kind: str,
+    metrics_dict: Optional[Dict[str, Callable]],
+) -> _SweepFrame:
+    """Make the frame that collects the `kind` ("normal" or "patched")
+    completions of a sweep: a Parquet file next to `output_path` if it is
+    provided, otherwise an in-memory frame."""
+    if output_path is None:
+        return _PreallocatedFrame(
+            total_rows=total_rows, index_name="completion_index"
+        )
+    return _ParquetStreamWriter(
+        path=f"{output_path}_{kind}.parquet",
+        index_name="completion_index",
+        metrics_dict=metrics_dict,
+    )
+
+
+def _categorize_prompts(
+    data: pd.DataFrame, prompts: List[str], rows_per_prompt: int
+):
+    """Replace the `prompts` column of `data`, which holds
+    `rows_per_prompt` rows for each of `prompts` in prompt-major order,
+    with a categorical column.  The codes are built directly without
+    looking at the strings.  The categories are sorted, so that grouping
+    by prompt gives the same order as for the uncategorized column."""
+    prompt_codes, unique_prompts = pd.factorize(
+        np.asarray(prompts, dtype=object), sort=True
+    )
+    data["prompts"] = pd.Categorical.from_codes(
+        np.repeat(prompt_codes, rows_per_prompt), categories=unique_prompts
+    )
+
+
+def _finish_sweep_frames(
+    frames: Tuple[_SweepFrame, _SweepFrame],
+    prompts: List[str],
+    metrics_dict: Optional[Dict[str, Callable]],
+    categorical_prompts: bool,
+) -> Union[Tuple[pd.DataFrame, pd.DataFrame], Tuple[str, str]]:
+    """Close the normal and patched `frames` of a finished sweep,
+    returning their Parquet file paths, or their DataFrames with the
+    prompts categorized if requested and metric columns added."""
+    normal_frame, patched_frame = frames
+    if isinstance(normal_frame, _ParquetStreamWriter):
+        assert isinstance(patched_frame, _ParquetStreamWriter)
+        return normal_frame.close(), patched_frame.close()
+    assert isinstance(patched_frame, _PreallocatedFrame)
+    # Create the final normal and patched completion frames
+    normal_all = normal_frame.to_frame()
+    patched_all = patched_frame.to_frame()
+    if categorical_prompts:
+        # Both frames are in prompt-major order
+        _categorize_prompts(
+            normal_all, prompts, normal_frame.total_rows // len(prompts)
+        )
+        _categorize_prompts(
+            patched_all, prompts, patched_frame.total_rows // len(prompts)
+        )
+    # Create and add metric columns
+    if metrics_dict is not None:
+        with torch.inference_mode():
+            normal_all = metrics.add_metric_cols(normal_all, metrics_dict)
+            patched_all = metrics.add_metric_cols(patched_all, metrics_dict)
+    return normal_all, patched_all
 
 
 @logging.loggable
@@ -117,14 +510,17 @@ def sweep_over_prompts(
             Dict[str, metrics.TokensMetricFunc],
         ]
     ] = None,
+    options: Optional[SweepOptions] = None,
     log: Union[bool, Dict] = False,  # pylint: disable=unused-argument
     **sampling_kwargs,
-) -> Tuple[pd.DataFrame, pd.DataFrame]:
+) -> Union[Tuple[pd.DataFrame, pd.DataFrame], Tuple[str, str]]:
     """Apply each provided ActivationAddition to each prompt num_completions
     times, returning the results in a dataframe.  The iterable of
     ActivationAdditions may be created directly for simple cases, or created by
     sweeping over e.g. layers, coeffs, ingredients, etc. using other
-    functions in this module.
+    functions in this module.  Prompts with the same token length are
+    batched together, so that each set of hook functions is installed
+    once per group of prompts rather than once per prompt.
 
     args:
         model: The model to use for completion.
@@ -142,7 +538,17 @@ def sweep_over_prompts(
 
         tokens_to_generate: The number of additional tokens to generate.
 
-        seed: A random seed to use for generation.
+        seed: A random seed to use for generation.  The seed is set
+        once per generate call, so when sampling (temperature > 0) the
+        completions for a prompt also depend on which other prompts are
+        batched with it, i.e. on the other prompts, their token lengths
+        and `max_batch_size`.  Greedy completions don't.
+
+        metrics_dict: An optional dict of named metric functions to
+        apply to the completions.
+
+        options: Optional batching, caching, output and fusing
+        settings; see `SweepOptions`.  Defaults to `SweepOptions()`.
 
         `log`: To enable logging of this call to wandb, pass either
         True, or a dict contining any of ('tags', 'group', 'notes') to
@@ -154,51 +560,134 @@ def sweep_over_prompts(
     returns:
         A tuple of DataFrames, one containing normal, unpatched
         completions for each prompt, the other containing patched
-        completions.
+        completions.  If `options.output_path` is provided, the paths of
+        the corresponding Parquet files are returned instead.
     """
-    # Iterate over prompts
-    normal_list = []
-    patched_list = []
-    for prompt in tqdm(prompts):
-        # Generate the normal completions for this prompt, with logging
-        # forced off since we'll be logging to final DataFrames
-        normal_df: pd.DataFrame = gen_using_hooks(
+    if options is None:
+        options = SweepOptions()
+    prompts = list(prompts)
+    activation_additions = list(activation_additions)
+    # Tokenize each prompt once, up front.  Prompts with the same token
+    # length can be generated as a single batch without any padding, so
+    # group them up front too.
+    prompt_tokens = [model.to_tokens(prompt) for prompt in prompts]
+    prompt_groups = _group_prompts_by_length(prompt_tokens)
+    frames = (
+        _make_sweep_frame(
+            len(prompts) * num_normal_completions,
+            options.output_path,
+            "normal",
+            metrics_dict,
+        ),
+        _make_sweep_frame(
+            len(prompts) * len(activation_additions) * num_patched_completions,
+            options.output_path,
+            "patched",
+            metrics_dict,
+        ),
+    )
+    normal_keys = [
+        (
+            prompt,
+            num_normal_completions,
+            tokens_to_generate,
+            seed,
+            tuple(sorted(sampling_kwargs.items())),
+        )
+        for prompt in prompts
+    ]
+    normal_cache = {} if options.normal_cache is None else options.normal_cache
+    try:
+        # Generate the normal completions, with logging forced off since
+        # we'll be logging to final DataFrames.  Only generate for
+        # prompts that aren't already in the cache.
+        normal_dfs = _gen_over_prompt_batches(
             model=model,
-            prompt_batch=[prompt] * num_normal_completions,
+            prompts=prompts,
+            prompt_batches=_make_prompt_batches(
+                prompt_tokens=prompt_tokens,
+                prompt_groups=[
+                    [
+                        idx
+                        for idx in group
+                        if normal_keys[idx] not in normal_cache
+                    ]
+                    for group in prompt_groups
+                ],
+                num_completions=num_normal_completions,
+                max_batch_size=options.max_batch_size,
+            ),
+            num_completions=num_normal_completions,
             hook_fns={},
             tokens_to_generate=tokens_to_generate,
             seed=seed,
-            log=False,
             **sampling_kwargs,
         )
-        # Append for later concatenation
-        normal_list.append(normal_df)
-        # Iterate over ActivationAdditions
+        for prompt_index, normal_df in enumerate(normal_dfs):
+            if normal_keys[prompt_index] in normal_cache:
+                normal_df = normal_cache[normal_keys[prompt_index]]
+            else:
+                normal_cache[normal_keys[prompt_index]] = normal_df
+            frames[0].set_rows(
+                prompt_index * num_normal_completions, normal_df
+            )
+        # Run one forward pass per unique phrase and act_name, rather than
+        # one per ActivationAddition, since coeffs only rescale activations
+        activation_cache = hook_utils.precompute_activation_cache(
+            model, activation_additions
+        )
+        # The patched batches are the same for every ActivationAddition
+        # list, so build their input tokens once
+        patched_batches = _make_prompt_batches(
+            prompt_tokens=prompt_tokens,
+            prompt_groups=prompt_groups,
+            num_completions=num_patched_completions,
+            max_batch_size=options.max_batch_size,
+        )
+        # Track progress with a single flat counter over all
+        # (prompt, ActivationAddition list) pairs
+        pbar = tqdm(total=len(prompts) * len(activation_additions))
+        # Iterate over ActivationAdditions, computing the hook functions
+        # once and applying them to all prompts.  Results are written
+        # straight into their final prompt-major positions.
         for index, activation_additions_this in enumerate(
-            tqdm(activation_additions)
+            activation_additions
         ):
             # Generate the patched completions, with logging
             # forced off since we'll be logging to final DataFrames
-            patched_df: pd.DataFrame = gen_using_activation_additions(
+            patched_dfs = _gen_over_prompt_batches(
                 model=model,
-                activation_additions=activation_additions_this,
-                prompt_batch=[prompt] * num_patched_completions,
+                prompts=prompts,
+                prompt_batches=patched_batches,
+                num_completions=num_patched_completions,
+                hook_fns=hook_utils.hook_fns_from_activation_additions(
+                    model=model,
+                    activation_additions=activation_additions_this,
+                    activation_cache=activation_cache,
+                    fuse=options.fuse_activation_additions,
+                ),
+                pbar=pbar,
                 tokens_to_generate=tokens_to_generate,
                 seed=seed,
-                log=False,
                 **sampling_kwargs,
             )
-            patched_df["activation_addition_index"] = index
-            # Store for later
-            patched_list.append(patched_df)
-    # Create the final normal and patched completion frames
-    normal_all = pd.concat(normal_list).reset_index(names="completion_index")
-    patched_all = pd.concat(patched_list).reset_index(names="completion_index")
-    # Create and add metric columns
-    if metrics_dict is not None:
-        normal_all = metrics.add_metric_cols(normal_all, metrics_dict)
-        patched_all = metrics.add_metric_cols(patched_all, metrics_dict)
-    return normal_all, patched_all
+            for prompt_index, patched_df in enumerate(patched_dfs):
+                patched_df["activation_addition_index"] = index
+                frames[1].set_rows(
+                    (prompt_index * len(activation_additions) + index)
+                    * num_patched_completions,
+                    patched_df,
+                )
+        pbar.close()
+    except BaseException:
+        # Don't leave truncated Parquet files behind
+        for frame in frames:
+            if isinstance(frame, _ParquetStreamWriter):
+                frame.abort()
+        raise
+    return _finish_sweep_frames(
+        frames, prompts, metrics_dict, options.categorical_prompts
+    )
 
 
 # TODO: this interface overall is somewhat awkward and could be
@@ -247,32 +736,130 @@ def sweep_over_metrics(
     """
     # Create the input text DataFrame
     inputs_df = pd.DataFrame({"input": inputs})
+    activation_additions = list(activation_additions)
+    patched_frame = _PreallocatedFrame(
+        total_rows=len(inputs_df) * len(activation_additions),
+        index_name="input_index",
+    )
+    # Start from an unhooked model; each iteration below only clears
+    # the hook points it used
+    model.remove_all_hook_fns()
+    # Run one forward pass per unique phrase and act_name, rather than
+    # one per ActivationAddition, since coeffs only rescale activations
+    activation_cache = hook_utils.precompute_activation_cache(
+        model, activation_additions
+    )
     # Iterate over ActivationAdditions
-    patched_list = []
     for index, activation_additions_this in enumerate(
         tqdm(activation_additions)
     ):
         hook_fns = hook_utils.hook_fns_from_activation_additions(
             model=model,
             activation_additions=activation_additions_this,
+            activation_cache=activation_cache,
         )
-        # Get the modified loss and append
-        model.remove_all_hook_fns()
-        for act_name, hook_fns_list in hook_fns.items():
-            for hook_fn in hook_fns_list:
-                model.add_hook(act_name, hook_fn)
-        patched_df = metrics.add_metric_cols(
-            inputs_df, metrics_dict, cols_to_use="input", **metric_args
-        )
+        # Attach the hooks directly to the hook points they need, so
+        # that only those hook points have to be cleared afterwards
+        hook_points = {
+            act_name: model.hook_dict[act_name] for act_name in hook_fns
+        }
+        try:
+            for act_name, hook_fns_list in hook_fns.items():
+                for hook_fn in hook_fns_list:
+                    hook_points[act_name].add_hook(hook_fn)
+            # Get the modified loss and append.  Metrics only ever run
+            # the model forward, so skip autograd bookkeeping entirely.
+            with torch.inference_mode():
+                patched_df = metrics.add_metric_cols(
+                    inputs_df,
+                    metrics_dict,
+                    cols_to_use="input",
+                    **metric_args,
+                )
+        finally:
+            for hook_point in hook_points.values():
+                hook_point.remove_hooks(dir="fwd")
         patched_df["activation_addition_index"] = index
-        patched_list.append(patched_df)
-        model.remove_all_hook_fns()
+        patched_frame.set_rows(index * len(inputs_df), patched_df)
 
     # Create the final patched df and return both
-    patched_all = pd.concat(patched_list).reset_index(names="input_index")
+    patched_all = patched_frame.to_frame()
     return patched_all
 
 
+def _groupby_mean(data: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+    """Equivalent of `data.groupby(keys).mean(numeric_only=True)`,
+    computed by factorizing the key columns into a single group code and
+    accumulating each numeric column with `np.bincount`, which avoids
+    pandas' per-column groupby machinery on large sweep results."""
+    # Drop rows with missing keys, as groupby does
+    has_keys = data[keys].notna().all(axis=1)
+    if not has_keys.all():
+        data = data[has_keys]
+    # Factorize each key column, sorted so the groups come out in the
+    # same order as groupby
+    key_codes, key_uniques = zip(
+        *[pd.factorize(data[key], sort=True) for key in keys]
+    )
+    # Group categorical keys (e.g. from `categorical_prompts`) by their
+    # values, giving the same index as for the uncategorized column
+    key_uniques = [
+        uniques.astype(uniques.categories.dtype)
+        if isinstance(uniques.dtype, pd.CategoricalDtype)
+        else uniques
+        for uniques in key_uniques
+    ]
+    combined_codes = np.ravel_multi_index(
+        key_codes, [len(uniques) for uniques in key_uniques]
+    )
+    # Keep only the key combinations that actually occur
+    group_codes, group_ids = np.unique(combined_codes, return_inverse=True)
+    group_key_codes = np.unravel_index(
+        group_codes, [len(uniques) for uniques in key_uniques]
+    )
+    if len(keys) == 1:
+        index = pd.Index(
+            key_uniques[0].take(group_key_codes[0]), name=keys[0]
+        )
+    else:
+        index = pd.MultiIndex.from_arrays(
+            [
+                uniques.take(codes)
+                for uniques, codes in zip(key_uniques, group_key_codes)
+            ],
+            names=keys,
+        )
+    # Take the mean of each numeric column, skipping NaNs as groupby
+    # does.  Float columns keep their dtype, nullable extension columns
+    # (e.g. Int64) become Float64, and others become float64.
+    means = {}
+    value_cols = data.drop(columns=keys).select_dtypes(
+        include=["number", "bool"]
+    )
+    for col in value_cols.columns:
+        values = value_cols[col].to_numpy(
+            dtype=np.float64, na_value=np.nan
+        )
+        valid = ~np.isnan(values)
+        sums = np.bincount(
+            group_ids,
+            weights=np.where(valid, values, 0.0),
+            minlength=len(group_codes),
+        )
+        counts = np.bincount(
+            group_ids, weights=valid, minlength=len(group_codes)
+        )
+        with np.errstate(invalid="ignore", divide="ignore"):
+            col_means = sums / counts
+        dtype = value_cols[col].dtype
+        if not isinstance(dtype, np.dtype):
+            col_means = pd.array(col_means, dtype="Float64")
+        elif np.issubdtype(dtype, np.floating):
+            col_means = col_means.astype(dtype)
+        means[col] = col_means
+    return pd.DataFrame(means, index=index)
+
+
 def reduce_sweep_results(
     normal_df: pd.DataFrame,
     patched_df: pd.DataFrame,
@@ -283,13 +870,19 @@ def reduce_sweep_results(
       (ActivationAddition, prompt) pair,
     - join ActivationAddition information into patched data so that phrases,
       coeffs, act_names are available as columns"""
-    reduced_df = patched_df.groupby(
-        ["prompts", "activation_addition_index"]
-    ).mean(numeric_only=True)
-    reduced_joined_df = reduced_df.join(
-        activation_additions_df, on="activation_addition_index"
+    reduced_df = _groupby_mean(
+        patched_df, ["prompts", "activation_addition_index"]
     ).reset_index()
-    reduced_normal_df = normal_df.groupby(["prompts"]).mean(numeric_only=True)
+    # Look up the ActivationAddition info for each reduced row by its
+    # index label, as the join on activation_addition_index did, with a
+    # single reindex instead of a join followed by column alignment
+    activation_addition_rows = activation_additions_df.reindex(
+        reduced_df["activation_addition_index"].to_numpy()
+    ).reset_index(drop=True)
+    reduced_joined_df = pd.concat(
+        [reduced_df, activation_addition_rows], axis=1, copy=False
+    )
+    reduced_normal_df = _groupby_mean(normal_df, ["prompts"])
     return reduced_normal_df, reduced_joined_df
 
 
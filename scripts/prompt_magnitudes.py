@@ -33,7 +33,7 @@ except ImportError:
 # %%
 import torch
 import pandas as pd
-from typing import List, Dict
+from typing import List, Dict, Tuple
 
 from transformer_lens.HookedTransformer import HookedTransformer
 
@@ -44,11 +44,12 @@ from activation_additions.prompt_utils import ActivationAddition
 device: str = "cpu"
 model_name = "gpt2-xl"
 model: HookedTransformer = HookedTransformer.from_pretrained(
-    model_name, device="cpu"
+    model_name, device=device
 )
-_ = model.to(device)
 
-_ = torch.set_grad_enabled(False)
+# Nothing below needs gradients; the magnitude loops additionally run
+# under torch.inference_mode()
+_ = model.requires_grad_(False)
 torch.manual_seed(0)  # For reproducibility
 
 # %% [markdown]
@@ -120,37 +121,45 @@ import plotly.graph_objects as go
 import numpy as np
 
 
-def magnitude_histogram(df: pd.DataFrame) -> go.Figure:
-    """Plot a histogram of the residual stream magnitudes for each layer
-    of the network."""
-    assert (
-        "Magnitude" in df.columns
-    ), "Dataframe must have a 'Magnitude' column"
+def log_magnitude_histogram(
+    log_mags: np.ndarray, act_locs: np.ndarray, nbins: int = 100
+) -> go.Figure:
+    """Plot a histogram of the log10 residual stream magnitudes
+    `log_mags` for each layer of the network, where `act_locs` gives the
+    activation location of each magnitude. The magnitudes are binned in
+    numpy, so the figure only carries the bin counts rather than every
+    magnitude."""
+    finite: np.ndarray = np.isfinite(log_mags)
 
-    df["LogMagnitude"] = np.log10(df["Magnitude"])
+    # Use the same bins for every activation location, so that the
+    # overlaid bars line up
+    edges: np.ndarray = np.histogram_bin_edges(log_mags[finite], bins=nbins)
+    centers: np.ndarray = 0.5 * (edges[:-1] + edges[1:])
 
-    # Get the number of unique activation locations
-    num_unique_activation_locations = df["Activation Location"].nunique()
+    locations, location_ids = np.unique(act_locs, return_inverse=True)
 
     # Generate a color list that is long enough to accommodate all unique activation locations
-    extended_rainbow = (
-        px.colors.sequential.Rainbow * num_unique_activation_locations
-    )
-    color_list = extended_rainbow[:num_unique_activation_locations]
+    extended_rainbow = px.colors.sequential.Rainbow * len(locations)
 
-    fig = px.histogram(
-        df,
-        x="LogMagnitude",
-        color="Activation Location",
-        marginal="rug",
-        histnorm="percent",
-        nbins=100,
-        opacity=0.5,
-        barmode="overlay",
-        color_discrete_sequence=color_list,
-    )
+    fig = go.Figure()
+    for idx, (act_loc, color) in enumerate(zip(locations, extended_rainbow)):
+        counts, _ = np.histogram(
+            log_mags[(location_ids == idx) & finite], bins=edges
+        )
+        fig.add_trace(
+            go.Bar(
+                x=centers,
+                y=100 * counts / max(counts.sum(), 1),
+                width=edges[1] - edges[0],
+                name=str(act_loc),
+                marker_color=color,
+                opacity=0.5,
+            )
+        )
 
     fig.update_layout(
+        barmode="overlay",
+        bargap=0,
         legend_title_text="Layer Number",
         title="Residual Stream Magnitude by Layer Number",
         xaxis_title="Magnitude (log 10)",
@@ -161,37 +170,77 @@ def magnitude_histogram(df: pd.DataFrame) -> go.Figure:
 
 
 # %%
-# Create an empty dataframe with the required columns
-prompt_df = pd.DataFrame(columns=DF_COLS)
-
 from activation_additions import prompt_utils
 
+
+def release_sweep_memory() -> None:
+    """Return the GPU memory cached for a finished sweep's activations to
+    the driver, so that it doesn't fragment the allocator for the rest of
+    the script."""
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+# Tokenized prompt lists, shared between sweeps over the same prompts
+prompt_tokens_cache: Dict[Tuple[str, ...], List[torch.Tensor]] = {}
+
+
+def build_log_magnitudes(
+    model: HookedTransformer,
+    prompts: List[str],
+    act_locs: Dict[str, float],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Compute the log10 residual stream magnitudes of every token of
+    `prompts` at each activation name in `act_locs`, which maps the
+    names to the locations to plot them at. Returns the log magnitudes
+    and the location of each, as arrays for `log_magnitude_histogram`.
+
+    The magnitudes are only needed for the histogram, so their log is
+    taken on the device and they stay there until the sweep is done,
+    then they're copied to the CPU all at once."""
+    key: Tuple[str, ...] = tuple(prompts)
+    if key not in prompt_tokens_cache:
+        prompt_tokens_cache[key] = [
+            model.to_tokens(prompt)[0] for prompt in prompts
+        ]
+    prompt_tokens: List[torch.Tensor] = prompt_tokens_cache[key]
+
+    log_mags_lst: List[torch.Tensor] = []
+    act_locs_lst: List[np.ndarray] = []
+    with torch.inference_mode():
+        for act_name, act_loc in act_locs.items():
+            # Run all the prompts through the model in a single batch
+            batch_mags: List[
+                torch.Tensor
+            ] = hook_utils.batched_prompt_magnitudes(
+                model=model,
+                prompts=prompts,
+                act_name=act_name,
+                prompt_tokens=prompt_tokens,
+            )
+            log_mags_lst.append(torch.cat(batch_mags).log10_())
+            act_locs_lst.append(np.full(log_mags_lst[-1].shape[0], act_loc))
+        log_mags: np.ndarray = torch.cat(log_mags_lst).float().cpu().numpy()
+    release_sweep_memory()
+    return log_mags, np.concatenate(act_locs_lst)
+
+
+# %%
 # Loop through activation locations and prompts
 activation_locations_8: List[int] = torch.arange(
     0, num_layers, num_layers // 8
 ).tolist()
-for act_loc in activation_locations_8:
-    act_name: str = prompt_utils.get_block_name(block_num=act_loc)
-    for prompt in prompts:
-        mags: torch.Tensor = hook_utils.prompt_magnitudes(
-            model=model, prompt=prompt, act_name=act_name
-        ).cpu()
-
-        # Create a new dataframe row with the current data
-        row = pd.DataFrame(
-            {
-                "Prompt": prompt,
-                "Activation Location": act_loc,
-                "Activation Name": act_name,
-                "Magnitude": mags,
-            }
-        )
-
-        # Append the new row to the dataframe
-        prompt_df = pd.concat([prompt_df, row], ignore_index=True)
+prompt_log_mags, prompt_act_locs = build_log_magnitudes(
+    model=model,
+    prompts=prompts,
+    act_locs={
+        prompt_utils.get_block_name(block_num=act_loc): act_loc
+        for act_loc in activation_locations_8
+    },
+)
 
 # %%
-fig: go.Figure = magnitude_histogram(prompt_df)
+fig: go.Figure = log_magnitude_histogram(prompt_log_mags, prompt_act_locs)
 fig.show()
 
 # %% [markdown]
@@ -200,31 +249,20 @@ fig.show()
 
 # %%
 activation_locations: List[int] = list(range(7))
-first_7_df = pd.DataFrame(columns=DF_COLS)
-
+first_7_act_names: Dict[str, float] = {}
 for act_loc in activation_locations:
     prefixes = ["pre", "mid", "post"] if act_loc == 0 else ["mid", "post"]
     for prefix in prefixes:
-        act_name = f"blocks.{act_loc}.hook_resid_{prefix}"
-        for prompt in prompts:
-            mags: torch.Tensor = hook_utils.prompt_magnitudes(
-                model=model, prompt=prompt, act_name=act_name
-            ).cpu()
-            loc_delta = 0 if prefix == "pre" else 0.5 if prefix == "mid" else 1
-            # Create a new dataframe row with the current data
-            row = pd.DataFrame(
-                {
-                    "Prompt": prompt,
-                    "Activation Location": act_loc + loc_delta,
-                    "Activation Name": act_name,
-                    "Magnitude": mags,
-                }
-            )
+        loc_delta = 0 if prefix == "pre" else 0.5 if prefix == "mid" else 1
+        first_7_act_names[f"blocks.{act_loc}.hook_resid_{prefix}"] = (
+            act_loc + loc_delta
+        )
 
-            # Append the new row to the dataframe
-            first_7_df = pd.concat([first_7_df, row], ignore_index=True)
+first_7_log_mags, first_7_act_locs = build_log_magnitudes(
+    model=model, prompts=prompts, act_locs=first_7_act_names
+)
 
-fig: go.Figure = magnitude_histogram(first_7_df)
+fig: go.Figure = log_magnitude_histogram(first_7_log_mags, first_7_act_locs)
 fig.show()
 
 
@@ -640,7 +678,13 @@ def line_plot(
         assert col in df.columns, f"Column {col} not in dataframe"
 
     if log_y:
-        df["LogMagnitude"] = np.log10(df["Magnitude"])
+        # Take the log on a float array, in case the column has an
+        # object dtype
+        mags: np.ndarray = pd.to_numeric(
+            df["Magnitude"], errors="raise"
+        ).to_numpy(dtype=np.float32)
+        with np.errstate(divide="ignore"):
+            df["LogMagnitude"] = np.log10(mags)
 
     fig = px.line(
         df,
@@ -662,33 +706,47 @@ def line_plot(
 
 
 # %%
-# Create an empty dataframe with the required columns
+# Collect one row per token position, and build the dataframe once at
+# the end
 all_resid_pre_locations: List[int] = torch.arange(0, num_layers, 1).tolist()
-addition_df = pd.DataFrame(columns=DF_COLS)
+addition_rows: List[Tuple[str, int, str, float]] = []
 
 # Loop through activation locations and prompts
-for act_loc in all_resid_pre_locations:
-    act_name: str = prompt_utils.get_block_name(block_num=act_loc)
+with torch.inference_mode():
+    # Run each prompt through the model once, caching its activations
+    # at all of the locations
+    contexts: List[str] = ["MATS is really cool"]
+    activation_cache = hook_utils.precompute_prompt_activations(
+        model=model,
+        prompts=contexts,
+        act_names=[
+            prompt_utils.get_block_name(block_num=act_loc)
+            for act_loc in all_resid_pre_locations
+        ],
+    )
+    # The string tokens don't depend on the activation location
+    context_str_tokens: Dict[str, List[str]] = {
+        context: model.to_str_tokens(context) for context in contexts
+    }
+    for act_loc in all_resid_pre_locations:
+        act_name: str = prompt_utils.get_block_name(block_num=act_loc)
+
+        for context in contexts:
+            mags: torch.Tensor = hook_utils.prompt_magnitudes(
+                model=model,
+                prompt=context,
+                act_name=act_name,
+                activation_cache=activation_cache,
+            ).cpu()
+            str_tokens: List[str] = context_str_tokens[context]
 
-    for context in ("MATS is really cool",):
-        mags: torch.Tensor = hook_utils.prompt_magnitudes(
-            model=model, prompt=context, act_name=act_name
-        ).cpu()
-        str_tokens: List[str] = model.to_str_tokens(context)
-
-        for pos, mag in enumerate(mags):
-            # Create a new dataframe row with the current data
-            row = pd.DataFrame(
-                {
-                    "Prompt": [str_tokens[pos]],
-                    "Activation Location": [act_loc],
-                    "Activation Name": [act_name],
-                    "Magnitude": [mag],
-                }
+            # Create a new dataframe row for each token
+            addition_rows.extend(
+                (str_token, act_loc, act_name, mag)
+                for str_token, mag in zip(str_tokens, mags.tolist())
             )
 
-            # Append the new row to the dataframe
-            addition_df = pd.concat([addition_df, row], ignore_index=True)
+addition_df = pd.DataFrame(addition_rows, columns=DF_COLS)
 
 # %%
 for use_log in (True, False):
@@ -711,38 +769,51 @@ for use_log in (True, False):
 # number, with color representing the token location of the "MATS is
 # really cool" prompt
 
-# Create an empty dataframe with the required columns
+# Collect one row per token position, and build the dataframe once at
+# the end
 all_resid_pre_locations: List[int] = torch.arange(1, num_layers, 1).tolist()
-relative_df = pd.DataFrame(columns=DF_COLS)
+relative_rows: List[Tuple[str, int, str, float]] = []
 MATS_prompt: str = "MATS is really cool"
 
-mags_prev: torch.Tensor = hook_utils.prompt_magnitudes(
-    model=model, prompt=MATS_prompt, act_name=prompt_utils.get_block_name(0)
-).cpu()
-
-# Loop through activation locations and prompts
-for act_loc in all_resid_pre_locations:
-    act_name: str = prompt_utils.get_block_name(block_num=act_loc)
-    mags: torch.Tensor = hook_utils.prompt_magnitudes(
-        model=model, prompt=MATS_prompt, act_name=act_name
+with torch.inference_mode():
+    # Run the prompt through the model once, caching its activations at
+    # all of the locations
+    activation_cache = hook_utils.precompute_prompt_activations(
+        model=model,
+        prompts=[MATS_prompt],
+        act_names=[prompt_utils.get_block_name(0)]
+        + [
+            prompt_utils.get_block_name(block_num=act_loc)
+            for act_loc in all_resid_pre_locations
+        ],
+    )
+    mags_prev: torch.Tensor = hook_utils.prompt_magnitudes(
+        model=model,
+        prompt=MATS_prompt,
+        act_name=prompt_utils.get_block_name(0),
+        activation_cache=activation_cache,
     ).cpu()
-
     tokens: List[str] = model.to_str_tokens(MATS_prompt)
-    for pos, mag in enumerate(mags):
-        # Create a new dataframe row with the current data
-        row = pd.DataFrame(
-            {
-                "Prompt": [tokens[pos]],
-                "Activation Location": [act_loc],
-                "Activation Name": [act_name],
-                "Magnitude": [mag / mags_prev[pos]],
-            }
+
+    # Loop through activation locations and prompts
+    for act_loc in all_resid_pre_locations:
+        act_name: str = prompt_utils.get_block_name(block_num=act_loc)
+        mags: torch.Tensor = hook_utils.prompt_magnitudes(
+            model=model,
+            prompt=MATS_prompt,
+            act_name=act_name,
+            activation_cache=activation_cache,
+        ).cpu()
+
+        # Create a new dataframe row for each token
+        relative_rows.extend(
+            (token, act_loc, act_name, rel_mag)
+            for token, rel_mag in zip(tokens, (mags / mags_prev).tolist())
         )
 
-        # Append the new row to the dataframe
-        relative_df = pd.concat([relative_df, row], ignore_index=True)
+        mags_prev = mags
 
-    mags_prev = mags
+relative_df = pd.DataFrame(relative_rows, columns=DF_COLS)
 
 # %%
 relative_fig = line_plot(
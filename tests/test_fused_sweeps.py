@@ -0,0 +1,62 @@
+""" Test suite for fused_sweeps.py """
+# %%
+import pickle
+import os
+
+import pytest
+import numpy as np
+import pandas as pd
+
+from transformer_lens import HookedTransformer
+
+from activation_additions import fused_sweeps, sweeps, prompt_utils, utils
+
+utils.enable_ipython_reload()
+
+# Filename for pre-pickled assets
+SWEEP_OVER_PROMPTS_CACHE_FN: str = "tests/sweep_over_prompts_cache.pkl"
+
+# GPU sometimes produces different completions than CPU
+os.environ["CUDA_VISIBLE_DEVICES"] = ""
+
+
+@pytest.fixture(name="model")
+def fixture_model() -> HookedTransformer:
+    """Test fixture that returns a small pre-trained transformer used
+    for fast sweep testing."""
+    return HookedTransformer.from_pretrained(
+        model_name="attn-only-2l", device="cpu"
+    )
+
+
+@pytest.mark.parametrize("max_batch_size", [None, 4, 512])
+def test_sweep_over_layers_fused(model, max_batch_size):
+    """Test that generating ActivationAdditions in fused batches per
+    prompt gives the same results as sweep_over_prompts(), whether each
+    batch holds one, some or all of the ActivationAddition lists."""
+    activation_additions_df = sweeps.make_activation_additions(
+        phrases=[[("Love", 1.0), ("Fear", -1.0)]],
+        act_names=[prompt_utils.get_block_name(block_num=0)],
+        coeffs=np.array([1.0, 10.0]),
+        model=model,
+    )
+    patched_df = fused_sweeps.sweep_over_layers_fused(
+        model=model,
+        prompts=[
+            "Roses are red, violets are blue",
+            "The most powerful emotion is",
+            "I feel",
+        ],
+        activation_additions=activation_additions_df["activation_additions"],
+        num_patched_completions=4,
+        max_batch_size=max_batch_size,
+        temperature=0.0,
+    )
+    with open(SWEEP_OVER_PROMPTS_CACHE_FN, "rb") as file:
+        _, patched_target, activation_additions_target, _, _ = pickle.load(
+            file
+        )
+    pd.testing.assert_frame_equal(
+        activation_additions_df, activation_additions_target
+    )
+    pd.testing.assert_frame_equal(patched_df, patched_target)
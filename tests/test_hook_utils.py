@@ -218,6 +218,36 @@ def test_prompt_magnitudes(attn_2l_model):
     ), "Prompt magnitudes are not the right shape"
 
 
+def test_batched_prompt_magnitudes(attn_2l_model):
+    """Test that batched prompt magnitudes match the magnitudes of each
+    prompt computed on its own, for prompts of different lengths."""
+    prompts: List[str] = ["Hello", "I think you're a great person"]
+    act_name: str = prompt_utils.get_block_name(block_num=1)
+    batched_mags: List[torch.Tensor] = hook_utils.batched_prompt_magnitudes(
+        prompts=prompts, model=attn_2l_model, act_name=act_name
+    )
+    for prompt, mags in zip(prompts, batched_mags):
+        target: torch.Tensor = hook_utils.prompt_magnitudes(
+            prompt=prompt, model=attn_2l_model, act_name=act_name
+        )
+        assert mags.shape == target.shape
+        assert torch.allclose(
+            mags, target, atol=1e-4
+        ), "Batched magnitudes don't match unbatched magnitudes"
+
+    # Passing pre-tokenized prompts should give the same magnitudes
+    pretokenized_mags: List[
+        torch.Tensor
+    ] = hook_utils.batched_prompt_magnitudes(
+        prompts=prompts,
+        model=attn_2l_model,
+        act_name=act_name,
+        prompt_tokens=[attn_2l_model.to_tokens(p)[0] for p in prompts],
+    )
+    for mags, target in zip(pretokenized_mags, batched_mags):
+        assert torch.equal(mags, target)
+
+
 def test_relative_mags_ones(attn_2l_model):
     """Test whether the relative magnitudes are one for a prompt and
     its own ActivationAddition."""
@@ -257,3 +287,143 @@ def test_relative_mags_diff_shape(attn_2l_model):
             model=attn_2l_model,
             act_adds=[add],
         )
+
+
+def test_precompute_activation_cache(attn_2l_model):
+    """Test that the activation cache holds one entry per unique prompt
+    and act_name, and that cached activations are rescaled by each
+    ActivationAddition's coeff."""
+    activation_additions: List[List[ActivationAddition]] = [
+        [
+            ActivationAddition(prompt="Love", coeff=coeff, act_name=0),
+            ActivationAddition(prompt="Hate", coeff=-coeff, act_name=0),
+        ]
+        for coeff in [1.0, 5.0]
+    ]
+    activation_cache = hook_utils.precompute_activation_cache(
+        model=attn_2l_model, activation_additions=activation_additions
+    )
+    assert len(activation_cache) == 2, "Cache should have one entry per prompt"
+
+    for act_add in activation_additions[1]:
+        cached_acts: torch.Tensor = hook_utils.get_prompt_activations(
+            attn_2l_model, act_add, activation_cache=activation_cache
+        )
+        uncached_acts: torch.Tensor = hook_utils.get_prompt_activations(
+            attn_2l_model, act_add
+        )
+        assert torch.allclose(
+            cached_acts, uncached_acts
+        ), "Cached activations don't match uncached activations"
+
+
+def test_precompute_activation_cache_padded(attn_2l_model):
+    """Test that activations precomputed in one padded batch match those
+    computed for each prompt on its own, for prompts of different
+    lengths."""
+    act_adds: List[ActivationAddition] = [
+        ActivationAddition(prompt="Love", coeff=1.0, act_name=1),
+        ActivationAddition(
+            prompt="I love you more than anything", coeff=1.0, act_name=1
+        ),
+    ]
+    activation_cache = hook_utils.precompute_activation_cache(
+        model=attn_2l_model, activation_additions=[act_adds]
+    )
+    for act_add in act_adds:
+        cached_acts: torch.Tensor = hook_utils.get_prompt_activations(
+            attn_2l_model, act_add, activation_cache=activation_cache
+        )
+        uncached_acts: torch.Tensor = hook_utils.get_prompt_activations(
+            attn_2l_model, act_add
+        )
+        assert cached_acts.shape == uncached_acts.shape
+        assert torch.allclose(
+            cached_acts, uncached_acts, atol=1e-5
+        ), "Padded activations don't match unpadded activations"
+
+
+def test_fused_activation_dict(attn_2l_model):
+    """Test that ActivationAdditions with the same act_name and length
+    are fused into one tensor equal to the sum of their activations."""
+    act_adds: List[ActivationAddition] = [
+        ActivationAddition(prompt="Love", coeff=2.0, act_name=0),
+        ActivationAddition(prompt="Hate", coeff=-1.0, act_name=0),
+        ActivationAddition(prompt="I love you", coeff=3.0, act_name=0),
+    ]
+    fused_dict = hook_utils.get_fused_activation_dict(
+        model=attn_2l_model, activation_additions=act_adds
+    )
+    act_dict = hook_utils.get_activation_dict(
+        model=attn_2l_model, activation_additions=act_adds
+    )
+    act_name: str = prompt_utils.get_block_name(block_num=0)
+    assert len(fused_dict[act_name]) == 2, "Should have one tensor per length"
+    assert torch.allclose(
+        fused_dict[act_name][0], act_dict[act_name][0] + act_dict[act_name][1]
+    ), "Fused activations don't match the sum of activations"
+    assert torch.allclose(
+        fused_dict[act_name][1], act_dict[act_name][2]
+    ), "Unfused activations should be unchanged"
+
+
+def test_precompute_prompt_activations(attn_2l_model):
+    """Test that magnitudes computed from activations cached across all
+    layers at once match those computed with a forward pass per layer."""
+    act_adds: List[ActivationAddition] = [
+        ActivationAddition(prompt="Anger", coeff=1.0, act_name=0),
+        ActivationAddition(prompt="Calm", coeff=-1.0, act_name=0),
+    ]
+    prompt: str = "I think you're"
+    act_names: List[str] = [
+        prompt_utils.get_block_name(block_num=num) for num in range(2)
+    ]
+    activation_cache = hook_utils.precompute_prompt_activations(
+        model=attn_2l_model,
+        prompts=[prompt] + [act_add.prompt for act_add in act_adds],
+        act_names=act_names,
+    )
+    assert len(activation_cache) == 6, "Expected one entry per prompt/layer"
+
+    for act_name in act_names:
+        relocated_adds: List[ActivationAddition] = [
+            ActivationAddition(
+                prompt=act_add.prompt, coeff=act_add.coeff, act_name=act_name
+            )
+            for act_add in act_adds
+        ]
+        cached_mags: torch.Tensor = (
+            hook_utils.steering_magnitudes_relative_to_prompt(
+                prompt=prompt,
+                act_adds=relocated_adds,
+                model=attn_2l_model,
+                activation_cache=activation_cache,
+            )
+        )
+        uncached_mags: torch.Tensor = (
+            hook_utils.steering_magnitudes_relative_to_prompt(
+                prompt=prompt, act_adds=relocated_adds, model=attn_2l_model
+            )
+        )
+        assert torch.allclose(
+            cached_mags, uncached_mags
+        ), "Cached magnitudes don't match uncached magnitudes"
+
+
+def test_batched_prompt_activations(attn_2l_model):
+    """Test that the batched steering vector matches the sum of the
+    activations of each ActivationAddition computed on its own."""
+    act_adds: List[ActivationAddition] = [
+        ActivationAddition(prompt="I love you", coeff=1.0, act_name=1),
+        ActivationAddition(prompt="I hate you", coeff=-1.0, act_name=1),
+    ]
+    batched_vec: torch.Tensor = hook_utils.batched_prompt_activations(
+        model=attn_2l_model, activation_additions=act_adds
+    )
+    target: torch.Tensor = hook_utils.get_prompt_activations(
+        attn_2l_model, act_adds[0]
+    ) + hook_utils.get_prompt_activations(attn_2l_model, act_adds[1])
+    assert batched_vec.shape == target.shape
+    assert torch.allclose(
+        batched_vec, target, atol=1e-4
+    ), "Batched steering vector doesn't match the unbatched one"
@@ -1,17 +1,24 @@
 """ Test suite for sweeps.py """
 # %%
 import pickle
-from typing import Tuple
+from typing import List, Optional, Tuple
 import os
 
 import pytest
 import numpy as np
 import pandas as pd
+import torch
 import plotly.graph_objects as go
 
 from transformer_lens import HookedTransformer
 
-from activation_additions import sweeps, prompt_utils, utils
+from activation_additions import (
+    sweeps,
+    prompt_utils,
+    utils,
+    metrics,
+    hook_utils,
+)
 from activation_additions.prompt_utils import ActivationAddition
 
 utils.enable_ipython_reload()
@@ -58,11 +65,71 @@ def test_make_activation_additions():
     )
 
 
+def test_make_activation_additions_pad(model):
+    """Test that make_activation_additions(pad=True) right-pads the
+    tokens of each phrase list with spaces to a common length, and that
+    the ActivationAdditions don't share token storage."""
+    phrases = [[("Love", 1.0), ("I hate you so much", -1.0)], [("Calm", 1.0)]]
+    activation_additions_df = sweeps.make_activation_additions(
+        phrases=phrases,
+        act_names=[0, 1],
+        coeffs=[1.0, 10.0],
+        pad=True,
+        model=model,
+    )
+    pad_token = model.to_single_token(" ")
+    for phrases_this, activation_additions in zip(
+        activation_additions_df["phrases"],
+        activation_additions_df["activation_additions"],
+    ):
+        phrase_tokens = [
+            model.to_tokens(phrase)[0].cpu() for phrase, _ in phrases_this
+        ]
+        max_len = max(len(tokens) for tokens in phrase_tokens)
+        for tokens, activation_addition in zip(
+            phrase_tokens, activation_additions
+        ):
+            assert activation_addition.tokens.device == torch.device("cpu")
+            assert len(activation_addition.tokens) == max_len
+            assert torch.equal(
+                activation_addition.tokens[: len(tokens)], tokens
+            )
+            padding = activation_addition.tokens[len(tokens) :]
+            assert (padding == pad_token).all()
+    # The phrase lists have different lengths, so padding must have
+    # happened
+    assert len(
+        activation_additions_df["activation_additions"][0][0].tokens
+    ) > len(model.to_tokens("Love")[0])
+    # Modifying one ActivationAddition's tokens in place mustn't change
+    # any other's, including those for the same phrase at other
+    # act_names and coeffs
+    all_tokens = [
+        activation_addition.tokens
+        for activation_additions in activation_additions_df[
+            "activation_additions"
+        ]
+        for activation_addition in activation_additions
+    ]
+    originals = [tokens.clone() for tokens in all_tokens]
+    all_tokens[0].fill_(-1)
+    for tokens, original in zip(all_tokens[1:], originals[1:]):
+        assert torch.equal(tokens, original)
+
+
 def do_sweep(
-    model: HookedTransformer, **sweep_kwargs
+    model: HookedTransformer,
+    prompts: Optional[List[str]] = None,
+    **sweep_kwargs,
 ) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
     """Convenience function to perform a small example sweep and return
     the resulting DataFrames"""
+    if prompts is None:
+        prompts = [
+            "Roses are red, violets are blue",
+            "The most powerful emotion is",
+            "I feel",
+        ]
     act_name: str = prompt_utils.get_block_name(block_num=0)
     activation_additions_df = sweeps.make_activation_additions(
         phrases=[[("Love", 1.0), ("Fear", -1.0)]],
@@ -71,11 +138,7 @@ def do_sweep(
     )
     normal_df, patched_df = sweeps.sweep_over_prompts(
         model=model,
-        prompts=[
-            "Roses are red, violets are blue",
-            "The most powerful emotion is",
-            "I feel",
-        ],
+        prompts=prompts,
         activation_additions=activation_additions_df["activation_additions"],
         num_normal_completions=4,
         num_patched_completions=4,
@@ -118,6 +181,305 @@ def test_sweep_over_prompts(model):
     pd.testing.assert_frame_equal(patched_df, patched_target)
 
 
+# Prompts with the same token length, which sweep_over_prompts()
+# generates together in a single batch
+EQUAL_LENGTH_PROMPTS: List[str] = ["I feel", "You feel", "We feel"]
+
+
+def test_sweep_over_prompts_equal_length_batch(model):
+    """Test that generating prompts of the same token length together in
+    one batch gives the same (greedy) results as sweeping over each
+    prompt on its own."""
+    # pylint: disable=protected-access
+    prompt_groups = sweeps._group_prompts_by_length(
+        [model.to_tokens(prompt) for prompt in EQUAL_LENGTH_PROMPTS]
+    )
+    assert (
+        len(prompt_groups) == 1
+    ), "Test prompts should all have the same token length"
+    normal_df, patched_df, _ = do_sweep(model, prompts=EQUAL_LENGTH_PROMPTS)
+    single_results = [
+        do_sweep(model, prompts=[prompt]) for prompt in EQUAL_LENGTH_PROMPTS
+    ]
+    pd.testing.assert_frame_equal(
+        normal_df,
+        pd.concat(
+            [normal for normal, _, _ in single_results], ignore_index=True
+        ),
+    )
+    pd.testing.assert_frame_equal(
+        patched_df,
+        pd.concat(
+            [patched for _, patched, _ in single_results], ignore_index=True
+        ),
+    )
+
+
+def test_sweep_over_prompts_max_batch_size(model):
+    """Test that limiting the generation batch size in
+    sweep_over_prompts() doesn't change the (greedy) results."""
+    normal_df, patched_df, _ = do_sweep(
+        model, options=sweeps.SweepOptions(max_batch_size=4)
+    )
+    normal_target, patched_target, _, _, _ = load_cached_sweep_over_prompts()
+    pd.testing.assert_frame_equal(normal_df, normal_target)
+    pd.testing.assert_frame_equal(patched_df, patched_target)
+
+
+@pytest.mark.parametrize("max_batch_size", [1, 8])
+def test_sweep_over_prompts_max_batch_size_splits_group(
+    model, max_batch_size
+):
+    """Test that splitting a group of equal-length prompts over several
+    batches keeps the rows of sweep_over_prompts() in the same order and
+    with the same (greedy) content as generating the group at once.
+    With 4 completions per prompt, a max_batch_size of 1 puts each
+    prompt in its own batch, and 8 puts two prompts in the first batch
+    and one in the second."""
+    normal_df, patched_df, _ = do_sweep(model, prompts=EQUAL_LENGTH_PROMPTS)
+    normal_split, patched_split, _ = do_sweep(
+        model,
+        prompts=EQUAL_LENGTH_PROMPTS,
+        options=sweeps.SweepOptions(max_batch_size=max_batch_size),
+    )
+    pd.testing.assert_frame_equal(normal_split, normal_df)
+    pd.testing.assert_frame_equal(patched_split, patched_df)
+
+
+def test_sweep_over_prompts_normal_cache(model):
+    """Test that normal completions stored in a normal_cache by one
+    sweep_over_prompts() call are reused by the next."""
+    normal_cache = {}
+    do_sweep(
+        model, options=sweeps.SweepOptions(normal_cache=normal_cache)
+    )
+    assert len(normal_cache) == 3, "Expected one cache entry per prompt"
+    normal_df, _, _ = do_sweep(
+        model, options=sweeps.SweepOptions(normal_cache=normal_cache)
+    )
+    normal_target, _, _, _, _ = load_cached_sweep_over_prompts()
+    pd.testing.assert_frame_equal(normal_df, normal_target)
+
+
+def test_sweep_over_prompts_categorical_prompts(model):
+    """Test that sweep_over_prompts() can return the prompts column as a
+    categorical column with unchanged values."""
+    normal_df, patched_df, _ = do_sweep(
+        model, options=sweeps.SweepOptions(categorical_prompts=True)
+    )
+    normal_target, patched_target, _, _, _ = load_cached_sweep_over_prompts()
+    for results_df, target_df in [
+        (normal_df, normal_target),
+        (patched_df, patched_target),
+    ]:
+        assert isinstance(results_df["prompts"].dtype, pd.CategoricalDtype)
+        results_df["prompts"] = results_df["prompts"].astype(object)
+        pd.testing.assert_frame_equal(results_df, target_df)
+
+
+def assert_no_hooks(model: HookedTransformer):
+    """Assert that no forward hooks are left on any of the model's hook
+    points."""
+    for name, hook_point in model.hook_dict.items():
+        # pylint: disable=protected-access
+        assert not hook_point._forward_hooks, f"Hook left on {name}"
+
+
+def test_sweep_over_metrics(model):
+    """Test that sweep_over_metrics() gives the same metric values as
+    hooking the whole model for each ActivationAddition list, and leaves
+    no hooks on the model."""
+    inputs = ["I feel happy today", "The weather is"]
+    activation_additions = sweeps.make_activation_additions(
+        phrases=[[("Love", 1.0), ("Fear", -1.0)]],
+        act_names=[0, 1],
+        coeffs=[1.0, 10.0],
+    )["activation_additions"]
+    metrics_dict = {"loss": metrics.get_loss_metric(model, agg_mode="mean")}
+    results_df = sweeps.sweep_over_metrics(
+        model=model,
+        inputs=inputs,
+        activation_additions=activation_additions,
+        metrics_dict=metrics_dict,
+    )
+    assert_no_hooks(model)
+    # Compute the same metrics by adding each list's hooks to the model
+    inputs_df = pd.DataFrame({"input": inputs})
+    target_dfs = []
+    for index, activation_additions_this in enumerate(activation_additions):
+        hook_fns = hook_utils.hook_fns_from_activation_additions(
+            model=model, activation_additions=activation_additions_this
+        )
+        for act_name, hook_fns_list in hook_fns.items():
+            for hook_fn in hook_fns_list:
+                model.add_hook(act_name, hook_fn)
+        target_df = metrics.add_metric_cols(
+            inputs_df, metrics_dict, cols_to_use="input"
+        )
+        model.remove_all_hook_fns()
+        target_df["activation_addition_index"] = index
+        target_dfs.append(target_df)
+    target_df = pd.concat(target_dfs).reset_index(names="input_index")
+    pd.testing.assert_frame_equal(results_df, target_df)
+
+
+def test_sweep_over_metrics_error(model):
+    """Test that sweep_over_metrics() removes its hooks from the model
+    when a metric raises an exception."""
+
+    def failing_metric(strs, show_progress, index):
+        """A metric that always fails."""
+        # pylint: disable=unused-argument
+        raise RuntimeError("Metric failed")
+
+    with pytest.raises(RuntimeError, match="Metric failed"):
+        sweeps.sweep_over_metrics(
+            model=model,
+            inputs=["I feel happy today"],
+            activation_additions=[
+                [ActivationAddition(prompt="Love", coeff=1.0, act_name=0)]
+            ],
+            metrics_dict={"failing": failing_metric},
+        )
+    assert_no_hooks(model)
+
+
+def test_sweep_over_prompts_output_path(model, tmp_path):
+    """Test that sweep_over_prompts() can stream its results to Parquet
+    files, with patched rows ordered by ActivationAddition then prompt."""
+    pytest.importorskip("pyarrow")
+    normal_path, patched_path, _ = do_sweep(
+        model, options=sweeps.SweepOptions(output_path=str(tmp_path / "sweep"))
+    )
+    normal_target, patched_target, _, _, _ = load_cached_sweep_over_prompts()
+    pd.testing.assert_frame_equal(pd.read_parquet(normal_path), normal_target)
+    pd.testing.assert_frame_equal(
+        pd.read_parquet(patched_path),
+        patched_target.sort_values(
+            "activation_addition_index", kind="stable"
+        ).reset_index(drop=True),
+    )
+
+
+def test_sweep_over_prompts_output_path_error(model, tmp_path):
+    """Test that an error partway through a sweep streaming to Parquet
+    files deletes the incomplete files."""
+    pytest.importorskip("pyarrow")
+    calls = []
+
+    def failing_metric(strs, show_progress, index):
+        """A metric that fails after the first chunk has been written."""
+        # pylint: disable=unused-argument
+        calls.append(len(strs))
+        if len(calls) > 1:
+            raise RuntimeError("Metric failed")
+        return pd.DataFrame({"length": strs.str.len()}, index=index)
+
+    with pytest.raises(RuntimeError, match="Metric failed"):
+        do_sweep(
+            model,
+            options=sweeps.SweepOptions(output_path=str(tmp_path / "sweep")),
+            metrics_dict={"failing": failing_metric},
+        )
+    assert len(calls) == 2, "Expected the second chunk to fail"
+    assert not list(tmp_path.iterdir()), "Expected no Parquet files"
+
+
+def test_sweep_over_prompts_output_path_early_error(model, tmp_path):
+    """Test that an error before a sweep has written anything leaves the
+    Parquet files of an earlier sweep to the same path alone."""
+    pytest.importorskip("pyarrow")
+    normal_path, patched_path, _ = do_sweep(
+        model, options=sweeps.SweepOptions(output_path=str(tmp_path / "sweep"))
+    )
+
+    def failing_metric(strs, show_progress, index):
+        """A metric that always fails."""
+        # pylint: disable=unused-argument
+        raise RuntimeError("Metric failed")
+
+    with pytest.raises(RuntimeError, match="Metric failed"):
+        do_sweep(
+            model,
+            options=sweeps.SweepOptions(output_path=str(tmp_path / "sweep")),
+            metrics_dict={"failing": failing_metric},
+        )
+    assert os.path.exists(normal_path) and os.path.exists(patched_path)
+
+
+@pytest.mark.parametrize(
+    "chunks",
+    [
+        # Uniform numpy dtypes, written into pre-allocated columns
+        [
+            pd.DataFrame({"a": [1, 2], "b": ["x", "y"]}),
+            pd.DataFrame({"a": [3, 4], "b": ["z", "w"]}),
+        ],
+        # Bool chunks mixed with NaN, which pd.concat makes object
+        [
+            pd.DataFrame({"a": [True, False]}),
+            pd.DataFrame({"a": [np.nan, 1.0]}),
+        ],
+        # Extension dtypes
+        [
+            pd.DataFrame(
+                {
+                    "a": pd.array([1, None], dtype="Int64"),
+                    "b": pd.array(["x", "y"], dtype="string"),
+                    "c": pd.Categorical(["x", "y"]),
+                }
+            ),
+            pd.DataFrame(
+                {
+                    "a": pd.array([3, 4], dtype="Int64"),
+                    "b": pd.array(["z", None], dtype="string"),
+                    "c": pd.Categorical(["y", "x"]),
+                }
+            ),
+        ],
+    ],
+)
+def test_preallocated_frame_matches_concat(chunks):
+    """Test that _PreallocatedFrame gives the same result as
+    concatenating its chunks, whichever order they are written in."""
+    expected = pd.concat(chunks).reset_index(names="index")
+    starts = np.cumsum([0] + [len(chunk) for chunk in chunks])
+    for order in [range(len(chunks)), reversed(range(len(chunks)))]:
+        # pylint: disable=protected-access
+        frame = sweeps._PreallocatedFrame(
+            total_rows=starts[-1], index_name="index"
+        )
+        for chunk_index in order:
+            frame.set_rows(starts[chunk_index], chunks[chunk_index])
+        pd.testing.assert_frame_equal(frame.to_frame(), expected)
+
+
+@pytest.mark.parametrize("keys", [["prompts"], ["prompts", "index"]])
+def test_groupby_mean_matches_groupby(keys):
+    """Test that _groupby_mean() matches groupby().mean() on missing keys
+    and on nullable and non-float value columns."""
+    data = pd.DataFrame(
+        {
+            "prompts": ["a", "b", np.nan, "a", "c"],
+            "index": [1, 1, 2, 2, 1],
+            "nullable_int": pd.array([1, None, 3, 4, None], dtype="Int64"),
+            "nullable_float": pd.array(
+                [1.5, None, 3.0, 4.0, 5.0], dtype="Float64"
+            ),
+            "float32": np.array([1, 2, 3, 4, np.nan], dtype=np.float32),
+            "int": [1, 2, 3, 4, 5],
+            "bool": [True, False, True, True, False],
+            "text": ["v", "w", "x", "y", "z"],
+        }
+    )
+    pd.testing.assert_frame_equal(
+        sweeps._groupby_mean(  # pylint: disable=protected-access
+            data, keys
+        ),
+        data.groupby(keys).mean(numeric_only=True),
+    )
+
+
 def test_reduce_sweep_results():
     """Test for reduce_sweep_results().  Uses a pre-prepared set of
     sweep results as input, and pre-calculated reduction results as test
@@ -139,6 +501,27 @@ def test_reduce_sweep_results():
     pd.testing.assert_frame_equal(reduced_patched_df, reduced_patched_target)
 
 
+def test_reduce_sweep_results_categorical_prompts(model):
+    """Test that reduce_sweep_results() gives the same results for a
+    sweep with categorical prompts as for the pre-calculated reduction
+    targets."""
+    normal_df, patched_df, activation_additions_df = do_sweep(
+        model, options=sweeps.SweepOptions(categorical_prompts=True)
+    )
+    (
+        _,
+        _,
+        _,
+        reduced_normal_target,
+        reduced_patched_target,
+    ) = load_cached_sweep_over_prompts()
+    reduced_normal_df, reduced_patched_df = sweeps.reduce_sweep_results(
+        normal_df, patched_df, activation_additions_df
+    )
+    pd.testing.assert_frame_equal(reduced_normal_df, reduced_normal_target)
+    pd.testing.assert_frame_equal(reduced_patched_df, reduced_patched_target)
+
+
 def test_plot_sweep_results():
     """Test for plot_sweep_results(). Doesn't verify visual correctness
     of plot, just verifies that the function funs without exceptions